@@ -1,6 +1,15 @@
+import json
+from io import StringIO
+
+from django.conf import settings
 from django.contrib import admin
+from django.urls import reverse
+from django.utils.html import format_html, format_html_join
 
-from .models import Group, Post
+from .models import Group, Post, ProfileRecord, Tag
+from .profiling import ARTIFACTS, profile_storage
+from .rendering import render_bodies
+from .tags import sync_post_tags
 
 
 class PostAdmin(admin.ModelAdmin):
@@ -8,6 +17,12 @@ class PostAdmin(admin.ModelAdmin):
     search_fields = ('text',)
     list_filter = ('pub_date',)
     empty_value_display = '-пусто-'
+    exclude = ('text_html',)
+
+    def save_model(self, request, obj, form, change):
+        obj.text_html, = render_bodies([obj.text])
+        super().save_model(request, obj, form, change)
+        sync_post_tags(obj)
 
 
 class GroupAdmin(admin.ModelAdmin):
@@ -16,5 +31,71 @@ class GroupAdmin(admin.ModelAdmin):
     empty_value_display = '-пусто-'
 
 
-admin.site.register(Post, PostAdmin)
+class TagAdmin(admin.ModelAdmin):
+    list_display = ('name', 'post_count')
+    search_fields = ('name',)
+
+
+class ProfileRecordAdmin(admin.ModelAdmin):
+    list_display = ('created', 'method', 'path', 'status_code',
+                    'duration', 'query_count', 'query_time', 'downloads')
+    list_filter = ('created', 'status_code')
+    search_fields = ('path',)
+    fields = ('created', 'user', 'method', 'path', 'status_code',
+              'duration', 'query_count', 'query_time', 'downloads',
+              'top_functions', 'templates', 'queries')
+    readonly_fields = fields
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def _report(self, obj):
+        with profile_storage().open(f'{obj.key}.json') as fh:
+            return json.load(fh)
+
+    def downloads(self, obj):
+        return format_html_join(' ', '<a href="{}">{}</a>', (
+            (reverse('profile_artifact', args=[obj.key, kind]), kind)
+            for kind in ARTIFACTS))
+
+    downloads.short_description = 'Файлы'
+
+    def top_functions(self, obj):
+        import pstats
+
+        out = StringIO()
+        stats = pstats.Stats(profile_storage().path(f'{obj.key}.pstats'),
+                             stream=out)
+        stats.sort_stats('cumulative').print_stats(40)
+        return format_html('<pre>{}</pre>', out.getvalue())
+
+    top_functions.short_description = 'Функции'
+
+    def templates(self, obj):
+        return format_html('<table>{}</table>', format_html_join(
+            '', '<tr><td>{}</td><td>{} мс</td></tr>',
+            ((row['name'], f"{row['time'] * 1000:.1f}")
+             for row in self._report(obj)['templates'])))
+
+    templates.short_description = 'Шаблоны'
+
+    def queries(self, obj):
+        return format_html('<table>{}</table>', format_html_join(
+            '', '<tr><td>{} мс</td><td><code>{}</code><br>'
+                '<small>{} {}</small></td></tr>',
+            ((f"{row['time'] * 1000:.1f}", row['sql'], row['alias'],
+              row['origin'])
+             for row in self._report(obj)['queries'])))
+
+    queries.short_description = 'SQL'
+
+
+# The changelist reads a single database; sharded posts are not listed.
+if len(settings.POSTS_SHARD_ALIASES) == 1:
+    admin.site.register(Post, PostAdmin)
 admin.site.register(Group, GroupAdmin)
+admin.site.register(Tag, TagAdmin)
+admin.site.register(ProfileRecord, ProfileRecordAdmin)
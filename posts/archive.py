@@ -0,0 +1,81 @@
+import datetime as dt
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ArchivedComment, ArchivedPost, Comment, Post
+
+ARCHIVED_POST_FIELDS = ('id', 'text', 'text_html', 'pub_date', 'author_id',
+                        'group_id', 'image')
+ARCHIVED_COMMENT_FIELDS = ('id', 'post_id', 'author_id', 'text', 'text_html',
+                           'created')
+
+
+def archive_cutoff(days=None):
+    if days is None:
+        days = settings.POSTS_ARCHIVE_AFTER_DAYS
+    return timezone.now() - dt.timedelta(days=days)
+
+
+def archive_batch(cutoff, batch_size, using):
+    ids = list(Post.objects.using(using).filter(pub_date__lt=cutoff)
+               .order_by('pub_date')
+               .values_list('id', flat=True)[:batch_size])
+    if not ids:
+        return 0, 0
+
+    with transaction.atomic(using=using):
+        posts = (Post.objects.using(using).filter(id__in=ids)
+                 .values(*ARCHIVED_POST_FIELDS))
+        comments = (Comment.objects.using(using).filter(post_id__in=ids)
+                    .values(*ARCHIVED_COMMENT_FIELDS))
+        ArchivedPost.objects.using(using).bulk_create(
+            ArchivedPost(**row) for row in posts)
+        archived_comments = ArchivedComment.objects.using(using).bulk_create(
+            ArchivedComment(**row) for row in comments)
+        Comment.objects.using(using).filter(post_id__in=ids).delete()
+        Post.objects.using(using).filter(id__in=ids).delete()
+
+    return len(ids), len(archived_comments)
+
+
+class ArchiveChain:
+    """Hot queryset followed by its archived tail, for Paginator."""
+
+    def __init__(self, hot, cold):
+        self.hot = hot
+        self.cold = cold
+
+    def count(self):
+        return self.hot_count + self.cold.count()
+
+    @property
+    def hot_count(self):
+        if not hasattr(self, '_hot_count'):
+            self._hot_count = self.hot.count()
+        return self._hot_count
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return list(self[index:index + 1])[0]
+
+        start, stop = index.start or 0, index.stop
+        hot_count = self.hot_count
+        if stop is not None and stop <= hot_count:
+            return list(self.hot[start:stop])
+
+        items = list(self.hot[start:]) if start < hot_count else []
+        cold_start = max(start - hot_count, 0)
+        cold_stop = None if stop is None else stop - hot_count
+        return items + list(self.cold[cold_start:cold_stop])
+
+
+def find_post(author, post_id):
+    post = author.posts.filter(id=post_id).first()
+    if post is not None:
+        return post
+    return author.archived_posts.filter(id=post_id).first()
@@ -0,0 +1,196 @@
+import asyncio
+import json
+import threading
+from collections import deque
+from importlib import import_module
+from types import SimpleNamespace
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import auth
+from django.http import parse_cookie
+from django.urls import reverse
+
+from .feed import followed_sources
+from .models import Post
+from .sharding import shard_aliases
+
+RESYNC = None
+
+
+def post_event(post):
+    return {
+        'id': post.id,
+        'author_id': post.author_id,
+        'group_id': post.group_id,
+        'author': post.author.username,
+        'text': post.text[:100],
+        'url': reverse('post_view', args=[post.author.username, post.id]),
+    }
+
+
+def latest_post_ids():
+    return {alias: Post.objects.using(alias).order_by('-id')
+            .values_list('id', flat=True).first() or 0
+            for alias in shard_aliases()}
+
+
+def new_post_events(last_ids, limit=100):
+    events = []
+    for alias in shard_aliases():
+        posts = (Post.objects.using(alias)
+                 .filter(id__gt=last_ids.get(alias, 0))
+                 .prefetch_related('author').order_by('id')[:limit])
+        for post in posts:
+            last_ids[alias] = post.id
+            events.append(post_event(post))
+    return events
+
+
+class Subscription:
+    def __init__(self, loop, authors, groups, maxsize):
+        self.loop = loop
+        self.authors = authors
+        self.groups = groups
+        self.queue = asyncio.Queue(maxsize)
+
+    def wants(self, event):
+        return (event['author_id'] in self.authors
+                or event['group_id'] in self.groups)
+
+    def push(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESYNC)
+
+
+class Broadcaster:
+    def __init__(self, recent=1024):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._recent = deque(maxlen=recent)
+        self._recent_ids = set()
+        self._tail = None
+
+    def __len__(self):
+        return len(self._subscribers)
+
+    def subscribe(self, authors, groups=()):
+        loop = asyncio.get_running_loop()
+        subscription = Subscription(loop, set(authors), set(groups),
+                                    settings.SSE_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers.add(subscription)
+        if self._tail is None or self._tail.done():
+            self._tail = loop.create_task(self.tail())
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+            idle = not self._subscribers
+        if idle and self._tail is not None:
+            self._tail.cancel()
+            self._tail = None
+
+    def publish(self, event):
+        with self._lock:
+            if event['id'] in self._recent_ids:
+                return
+            if len(self._recent) == self._recent.maxlen:
+                self._recent_ids.discard(self._recent[0])
+            self._recent.append(event['id'])
+            self._recent_ids.add(event['id'])
+            subscribers = list(self._subscribers)
+
+        for subscription in subscribers:
+            if subscription.wants(event):
+                subscription.loop.call_soon_threadsafe(subscription.push,
+                                                       event)
+
+    async def tail(self):
+        last_ids = await sync_to_async(latest_post_ids)()
+        while True:
+            await asyncio.sleep(settings.SSE_POLL_INTERVAL)
+            events = await sync_to_async(new_post_events)(last_ids)
+            for event in events:
+                self.publish(event)
+
+
+broadcaster = Broadcaster()
+
+
+def publish_post(post):
+    broadcaster.publish(post_event(post))
+
+
+def _scope_user(scope):
+    cookies = parse_cookie(dict(scope['headers']).get(b'cookie', b'')
+                           .decode('latin-1'))
+    engine = import_module(settings.SESSION_ENGINE)
+    request = SimpleNamespace(
+        session=engine.SessionStore(
+            cookies.get(settings.SESSION_COOKIE_NAME)))
+    return auth.get_user(request)
+
+
+async def _respond(send, status, body=b''):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'text/plain')]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def _disconnected(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def post_events_app(scope, receive, send):
+    if len(broadcaster) >= settings.SSE_MAX_CONNECTIONS:
+        return await _respond(send, 503)
+
+    user = await sync_to_async(_scope_user)(scope)
+    if not user.is_authenticated:
+        return await _respond(send, 403)
+
+    authors, groups = await sync_to_async(followed_sources)(user)
+    subscription = broadcaster.subscribe(authors, groups)
+    disconnect = asyncio.ensure_future(_disconnected(receive))
+    message = None
+    try:
+        await send({'type': 'http.response.start', 'status': 200,
+                    'headers': [(b'content-type', b'text/event-stream'),
+                                (b'cache-control', b'no-cache'),
+                                (b'x-accel-buffering', b'no')]})
+        await send({'type': 'http.response.body', 'body': b'retry: 5000\n\n',
+                    'more_body': True})
+        while True:
+            if message is None:
+                message = asyncio.ensure_future(subscription.queue.get())
+            done, _ = await asyncio.wait(
+                {message, disconnect}, timeout=settings.SSE_HEARTBEAT,
+                return_when=asyncio.FIRST_COMPLETED)
+
+            if disconnect in done:
+                return
+            if message not in done:
+                body = b': ping\n\n'
+            else:
+                event, message = message.result(), None
+                if event is RESYNC:
+                    break
+                body = (f'id: {event["id"]}\nevent: post\n'
+                        f'data: {json.dumps(event)}\n\n').encode()
+            await send({'type': 'http.response.body', 'body': body,
+                        'more_body': True})
+
+        await send({'type': 'http.response.body',
+                    'body': b'event: resync\ndata: {}\n\n'})
+    finally:
+        broadcaster.unsubscribe(subscription)
+        disconnect.cancel()
+        if message is not None:
+            message.cancel()
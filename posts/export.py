@@ -0,0 +1,130 @@
+import json
+import zipfile
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import (ArchivedComment, ArchivedPost, Comment, Follow,
+                     GroupSubscription, Post)
+from .sharding import shard_aliases, sharded
+from .storage import CHUNK_SIZE
+
+ROWS_PER_QUERY = 500
+POST_FIELDS = ('id', 'text', 'pub_date', 'group_id', 'image')
+COMMENT_FIELDS = ('id', 'post_id', 'text', 'created')
+
+
+class ZipStream:
+    """Write-only file for ZipFile that hands out what was written so far.
+
+    It has no seek() or tell(), so ZipFile writes data descriptors after
+    each member instead of seeking back to fix up its header.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self.buffered = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self.buffered += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        self.buffered = 0
+        return data
+
+
+def _rows(querysets, fields, **extra):
+    for queryset in querysets:
+        for row in queryset.values(*fields).iterator(ROWS_PER_QUERY):
+            row.update(extra)
+            yield row
+
+
+def _post_rows(user):
+    yield from _rows(sharded(Post.objects.filter(author=user)
+                             .order_by('pub_date')),
+                     POST_FIELDS, archived=False)
+    yield from _rows(sharded(ArchivedPost.objects.filter(author=user)
+                             .order_by('pub_date')),
+                     POST_FIELDS, archived=True)
+
+
+def _comment_rows(user):
+    yield from _rows(sharded(Comment.objects.filter(author=user)
+                             .order_by('created')),
+                     COMMENT_FIELDS, archived=False)
+    yield from _rows(sharded(ArchivedComment.objects.filter(author=user)
+                             .order_by('created')),
+                     COMMENT_FIELDS, archived=True)
+
+
+def _subscription_rows(user):
+    for username in (Follow.objects.filter(user=user)
+                     .values_list('author__username', flat=True)
+                     .iterator(ROWS_PER_QUERY)):
+        yield {'author': username}
+    for slug in (GroupSubscription.objects.filter(user=user)
+                 .values_list('group__slug', flat=True)
+                 .iterator(ROWS_PER_QUERY)):
+        yield {'group': slug}
+
+
+def _image_names(user):
+    for alias in shard_aliases():
+        posts = (Post.objects.using(alias).filter(author=user)
+                 .exclude(image='').exclude(image=None)
+                 .values_list('image').order_by())
+        archived = (ArchivedPost.objects.using(alias).filter(author=user)
+                    .exclude(image='').exclude(image=None)
+                    .values_list('image').order_by())
+        for (name,) in (posts.union(archived).order_by('image')
+                        .iterator(ROWS_PER_QUERY)):
+            yield name
+
+
+def account_sections(user):
+    profile = {
+        'username': user.username,
+        'first_name': user.first_name,
+        'last_name': user.last_name,
+        'email': user.email,
+        'date_joined': user.date_joined,
+    }
+    yield 'profile.json', [profile]
+    yield 'posts.jsonl', _post_rows(user)
+    yield 'comments.jsonl', _comment_rows(user)
+    yield 'subscriptions.jsonl', _subscription_rows(user)
+
+
+def export_account(user):
+    """Yield the user's data as a zip archive, piece by piece."""
+    stream = ZipStream()
+    with zipfile.ZipFile(stream, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, rows in account_sections(user):
+            with archive.open(name, 'w', force_zip64=True) as member:
+                for row in rows:
+                    member.write(json.dumps(row, cls=DjangoJSONEncoder,
+                                            ensure_ascii=False).encode())
+                    member.write(b'\n')
+                    if stream.buffered >= CHUNK_SIZE:
+                        yield stream.drain()
+
+        storage = Post._meta.get_field('image').storage
+        for name in _image_names(user):
+            try:
+                source = storage.open(name)
+            except FileNotFoundError:
+                continue
+            with source, archive.open(f'images/{name}', 'w',
+                                      force_zip64=True) as member:
+                for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+                    member.write(chunk)
+                    if stream.buffered >= CHUNK_SIZE:
+                        yield stream.drain()
+    yield stream.drain()
@@ -0,0 +1,31 @@
+from django.db.models import Q
+
+from .models import Follow, GroupSubscription, Post
+from .sharding import authors_by_shard, sharded
+
+
+def followed_sources(user):
+    authors = list(Follow.objects.filter(user=user)
+                   .values_list('author_id', flat=True))
+    groups = list(GroupSubscription.objects.filter(user=user)
+                  .values_list('group_id', flat=True))
+    return authors, groups
+
+
+def source_querysets(authors, groups):
+    """Per shard, one queryset for the followed authors placed there and
+    one for the subscribed groups: a page costs the same number of queries
+    however many sources the user follows."""
+    querysets = [Post.objects.using(alias).filter(author_id__in=ids)
+                 for alias, ids in authors_by_shard(authors).items()]
+    if groups:
+        querysets += sharded(Post.objects.filter(group_id__in=groups))
+    return querysets
+
+
+def joined_querysets(authors, groups):
+    """The same feed as a single OR-join per shard, for comparison."""
+    if not authors and not groups:
+        return []
+    return sharded(Post.objects.filter(Q(author_id__in=authors)
+                                       | Q(group_id__in=groups)))
@@ -1,6 +1,7 @@
 from django.forms import ModelForm
 
 from .models import Comment, Post
+from .rendering import render_bodies
 
 
 class PostForm(ModelForm):
@@ -8,8 +9,17 @@ class PostForm(ModelForm):
         model = Post
         fields = ('group', 'text', 'image')
 
+    def save(self, commit=True):
+        self.instance.text_html, = render_bodies([self.instance.text])
+        return super().save(commit)
+
 
 class CommentForm(ModelForm):
     class Meta:
         model = Comment
         fields = ('text',)
+
+    def save(self, commit=True):
+        self.instance.text_html, = render_bodies([self.instance.text],
+                                                 link_tags=False)
+        return super().save(commit)
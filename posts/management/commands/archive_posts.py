@@ -0,0 +1,43 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from posts.archive import archive_batch, archive_cutoff
+from posts.sharding import shard_aliases
+
+
+class Command(BaseCommand):
+    help = 'Переносит старые посты и их комментарии в архивные таблицы'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int,
+                            default=settings.POSTS_ARCHIVE_AFTER_DAYS,
+                            help='Архивировать посты старше N дней')
+        parser.add_argument('--batch-size', type=int,
+                            default=settings.POSTS_ARCHIVE_BATCH_SIZE)
+        parser.add_argument('--pause', type=float, default=0,
+                            help='Пауза между пачками, в секундах')
+
+    def handle(self, *args, **options):
+        cutoff = archive_cutoff(options['days'])
+        total_posts = total_comments = 0
+
+        for alias in shard_aliases():
+            while True:
+                posts, comments = archive_batch(cutoff,
+                                                options['batch_size'],
+                                                alias)
+                if not posts:
+                    break
+                total_posts += posts
+                total_comments += comments
+                self.stdout.write(f'{alias}: перенесено постов: '
+                                  f'{total_posts}, '
+                                  f'комментариев: {total_comments}')
+                if options['pause']:
+                    time.sleep(options['pause'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Архивировано постов: {total_posts}, '
+            f'комментариев: {total_comments}'))
@@ -0,0 +1,101 @@
+import datetime as dt
+import random
+import time
+from contextlib import ExitStack
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.models import Max
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from posts.feed import joined_querysets, source_querysets
+from posts.models import Group, Post, User
+from posts.pagination import decode_cursor, keyset_page
+from posts.sharding import (ID_RANGE, shard_aliases, shard_for,
+                            temporary_databases)
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает ленту подписок, собранную слиянием потоков по '
+            'авторам и группам, с одним запросом через OR')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--authors', type=int, default=200)
+        parser.add_argument('--groups', type=int, default=20)
+        parser.add_argument('--posts', type=int, default=50000)
+        parser.add_argument('--follow-authors', type=int, default=50)
+        parser.add_argument('--follow-groups', type=int, default=5)
+        parser.add_argument('--pages', type=int, default=20,
+                            help='Сколько страниц пролистать')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        # Seeded into temporary databases, the configured ones are not
+        # touched.
+        with temporary_databases({'default', *shard_aliases()}):
+            authors, groups = self.seed(options)
+            for name, querysets in (
+                    ('слияние', source_querysets(authors, groups)),
+                    ('OR-запрос', joined_querysets(authors, groups))):
+                self.report(name, querysets, options['pages'])
+
+    def seed(self, options):
+        rng = random.Random(options['seed'])
+        User.objects.bulk_create(
+            User(username=f'bench_feed_{number}')
+            for number in range(options['authors']))
+        users = list(User.objects.filter(username__startswith='bench_feed_'))
+        Group.objects.bulk_create(
+            Group(title=f'Bench {number}', slug=f'bench-feed-{number}')
+            for number in range(options['groups']))
+        groups = list(Group.objects.filter(slug__startswith='bench-feed-'))
+
+        now = timezone.now()
+        posts = {}
+        for number in range(options['posts']):
+            author = rng.choice(users)
+            group = rng.choice(groups) if rng.random() < 0.5 else None
+            posts.setdefault(shard_for(author.pk, place=True), []).append(
+                Post(text=f'post {number}', author_id=author.pk,
+                     group_id=group and group.pk))
+        for alias, rows in posts.items():
+            # SQLite does not return ids from bulk_create, and bulk_update
+            # needs them to spread pub_date over a year.
+            last_id = (Post.objects.using(alias).aggregate(Max('id'))
+                       ['id__max']
+                       or shard_aliases().index(alias) * ID_RANGE)
+            for number, post in enumerate(rows, start=last_id + 1):
+                post.id = number
+            Post.objects.using(alias).bulk_create(rows, batch_size=500)
+            for post in rows:
+                post.pub_date = now - dt.timedelta(
+                    seconds=rng.randrange(365 * 24 * 3600))
+            Post.objects.using(alias).bulk_update(rows, ['pub_date'],
+                                                  batch_size=500)
+
+        authors = [user.pk for user in rng.sample(users,
+                                                  options['follow_authors'])]
+        groups = [group.pk for group in rng.sample(groups,
+                                                   options['follow_groups'])]
+        return authors, groups
+
+    def report(self, name, querysets, pages):
+        contexts = [CaptureQueriesContext(connections[alias])
+                    for alias in shard_aliases()]
+        cursor = None
+        rows = 0
+        with ExitStack() as stack:
+            for context in contexts:
+                stack.enter_context(context)
+            started = time.perf_counter()
+            for _ in range(pages):
+                posts, next_cursor = keyset_page(querysets, cursor)
+                rows += len(posts)
+                if next_cursor is None:
+                    break
+                cursor = decode_cursor(next_cursor)
+            elapsed = time.perf_counter() - started
+        queries = sum(len(context) for context in contexts)
+        self.stdout.write(f'{name:<10} {elapsed * 1000:8.1f} мс, '
+                          f'запросов: {queries}, постов: {rows}')
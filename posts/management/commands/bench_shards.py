@@ -0,0 +1,72 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.test.utils import override_settings
+
+from posts.models import Post, User
+from posts.sharding import shard_for, temporary_databases
+
+
+class Command(BaseCommand):
+    help = ('Замеряет конкурентную запись и чтение постов через '
+            'Post.objects в SQLite при разном числе шардов')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shards', type=int, nargs='+',
+                            default=[1, 2, 4])
+        parser.add_argument('--writers', type=int, default=8)
+        parser.add_argument('--posts', type=int, default=500,
+                            help='Постов на один поток')
+        parser.add_argument('--authors', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        for shards in options['shards']:
+            aliases = (['default'] if shards == 1 else
+                       [f'shard_{index}' for index in range(shards)])
+            # Temporary databases: the router, the placement table and its
+            # cache are the real ones, the configured files are untouched.
+            with override_settings(POSTS_SHARD_ALIASES=aliases), \
+                    temporary_databases({'default', *aliases}):
+                authors = self.create_authors(options['authors'])
+                written = self.run_threads(self.write, authors, options)
+                read = self.run_threads(self.read, authors, options)
+            total = options['writers'] * options['posts']
+            self.stdout.write(f'шардов: {shards:<3} '
+                              f'запись {total / written:8.0f} постов/с, '
+                              f'чтение {total / read:8.0f} страниц/с')
+
+    def create_authors(self, count):
+        User.objects.bulk_create(User(username=f'bench_shards_{number}')
+                                 for number in range(count))
+        authors = list(User.objects.values_list('id', flat=True))
+        # Placements are made once per author, before the clock starts.
+        for author_id in authors:
+            shard_for(author_id, place=True)
+        return authors
+
+    def write(self, author_id):
+        Post.objects.create(text='x' * 200, author_id=author_id)
+
+    def read(self, author_id):
+        list(User(pk=author_id).posts.all()[:10])
+
+    def run_threads(self, action, authors, options):
+        posts = options['posts']
+
+        def run(offset):
+            try:
+                for number in range(posts):
+                    action(authors[(offset * posts + number) % len(authors)])
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=run, args=(offset,))
+                   for offset in range(options['writers'])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - started
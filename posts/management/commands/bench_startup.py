@@ -0,0 +1,106 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Run in a fresh interpreter: the import and the first request of a new
+# worker, timed separately.
+FIRST_REQUEST = '''
+import json, sys, time
+started = time.perf_counter()
+import yatube.wsgi
+imported = time.perf_counter()
+from wsgiref.util import setup_testing_defaults
+environ = {'PATH_INFO': sys.argv[1], 'HTTP_HOST': 'localhost'}
+setup_testing_defaults(environ)
+statuses = []
+response = yatube.wsgi.application(
+    environ, lambda status, headers, exc_info=None: statuses.append(status))
+try:
+    b''.join(response)
+finally:
+    getattr(response, 'close', lambda: None)()
+print(json.dumps({'import': imported - started,
+                  'request': time.perf_counter() - imported,
+                  'status': statuses[0]}))
+'''
+
+
+def parse_importtime(output):
+    """(module, self µs, cumulative µs) for each line of -X importtime."""
+    rows = []
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        self_us, cumulative_us, module = line[len('import time:'):].split(
+            '|')
+        if not self_us.strip().isdigit():
+            continue
+        rows.append((module.strip(), int(self_us), int(cumulative_us)))
+    return rows
+
+
+class Command(BaseCommand):
+    help = ('Замеряет запуск воркера: время импорта модулей и первого '
+            'запроса к yatube.wsgi.application')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5)
+        parser.add_argument('--limit', type=int, default=20,
+                            help='Сколько самых медленных модулей вывести')
+        parser.add_argument('--sort', choices=('self', 'cumulative'),
+                            default='cumulative')
+        parser.add_argument('--path', default='/',
+                            help='Адрес первого запроса')
+        parser.add_argument('--preload', action='store_true',
+                            help='Запускать с WSGI_PRELOAD=1')
+
+    def handle(self, *args, **options):
+        env = dict(os.environ)
+        if options['preload']:
+            env['WSGI_PRELOAD'] = '1'
+
+        modules = defaultdict(lambda: ([], []))
+        timings = []
+        for _ in range(options['runs']):
+            stderr = self.run(env, '-X', 'importtime', '-c',
+                              'import yatube.wsgi').stderr
+            for module, self_us, cumulative_us in parse_importtime(stderr):
+                modules[module][0].append(self_us)
+                modules[module][1].append(cumulative_us)
+            timings.append(json.loads(
+                self.run(env, '-c', FIRST_REQUEST,
+                         options['path']).stdout.splitlines()[-1]))
+
+        column = 0 if options['sort'] == 'self' else 1
+        ranked = sorted(modules.items(),
+                        key=lambda item: -statistics.median(item[1][column]))
+        if options['limit']:
+            self.stdout.write(
+                f'{"модуль":<50} {"свой, мс":>9} {"всего, мс":>10}')
+        for module, (self_us, cumulative_us) in ranked[:options['limit']]:
+            self.stdout.write(
+                f'{module:<50} {statistics.median(self_us) / 1000:9.1f} '
+                f'{statistics.median(cumulative_us) / 1000:10.1f}')
+
+        runs = len(timings)
+        import_time = statistics.median(run['import'] for run in timings)
+        request_time = statistics.median(run['request'] for run in timings)
+        self.stdout.write(f'импорт yatube.wsgi: {import_time * 1000:.1f} мс '
+                          f'(медиана из {runs})')
+        self.stdout.write(f'первый запрос {options["path"]}: '
+                          f'{request_time * 1000:.1f} мс, '
+                          f'{timings[-1]["status"]}')
+
+    def run(self, env, *args):
+        result = subprocess.run([sys.executable, *args], env=env,
+                                cwd=settings.BASE_DIR, capture_output=True,
+                                text=True)
+        if result.returncode:
+            raise CommandError(result.stderr.strip().splitlines()[-1])
+        return result
@@ -0,0 +1,81 @@
+import os
+
+from django.core.files import File
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+from sorl.thumbnail import delete
+
+from posts.models import ArchivedPost, ImageBlob, Post
+from posts.sharding import sharded
+from posts.storage import content_hash, hashed_name, is_hashed_name
+
+UPLOAD_TO = 'posts'
+
+
+class Command(BaseCommand):
+    help = ('Переводит существующие изображения постов на хранение по хешу '
+            'содержимого и удаляет дубликаты')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        storage = Post._meta.get_field('image').storage
+        root = storage.path(UPLOAD_TO)
+        moved = removed = freed = 0
+
+        for directory, _, filenames in os.walk(root):
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                name = os.path.relpath(path, storage.location)
+                if is_hashed_name(name, UPLOAD_TO):
+                    continue
+
+                with open(path, 'rb') as fh:
+                    digest = content_hash(File(fh))
+                target = hashed_name(UPLOAD_TO, digest,
+                                     os.path.splitext(filename)[1])
+                duplicate = storage.exists(target)
+                if options['dry_run']:
+                    self.stdout.write(f'{name} -> {target}')
+                    removed += duplicate
+                    freed += os.path.getsize(path) if duplicate else 0
+                    continue
+
+                if duplicate:
+                    freed += os.path.getsize(path)
+                    os.remove(path)
+                    removed += 1
+                else:
+                    os.makedirs(os.path.dirname(storage.path(target)),
+                                exist_ok=True)
+                    os.replace(path, storage.path(target))
+                    moved += 1
+
+                for model in (Post, ArchivedPost):
+                    for queryset in sharded(model.objects.filter(image=name)):
+                        queryset.update(image=target)
+                delete(Post(image=name).image, delete_file=False)
+
+        if not options['dry_run']:
+            self.recount_references()
+        self.stdout.write(self.style.SUCCESS(
+            f'Перенесено: {moved}, удалено дубликатов: {removed}, '
+            f'освобождено: {freed} байт'))
+
+    def recount_references(self):
+        refs = {}
+        for model in (Post, ArchivedPost):
+            for queryset in sharded(model.objects.exclude(image='')
+                                    .exclude(image=None)):
+                counts = (queryset.order_by().values('image')
+                          .annotate(refs=Count('pk')))
+                for row in counts:
+                    refs[row['image']] = (refs.get(row['image'], 0)
+                                          + row['refs'])
+
+        with transaction.atomic():
+            for name, count in refs.items():
+                ImageBlob.objects.update_or_create(
+                    name=name, defaults={'refs': count})
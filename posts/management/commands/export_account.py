@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from posts.export import export_account
+from posts.models import User
+
+
+class Command(BaseCommand):
+    help = 'Выгружает посты, комментарии и картинки пользователя в zip'
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('--output',
+                            help='Файл архива, по умолчанию <username>.zip')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError('Пользователь не найден')
+
+        output = options['output'] or f'{user.username}.zip'
+        size = 0
+        with open(output, 'wb') as archive:
+            for chunk in export_account(user):
+                archive.write(chunk)
+                size += len(chunk)
+        self.stdout.write(self.style.SUCCESS(
+            f'{output}: {size / 1024:.0f} КБ'))
@@ -0,0 +1,59 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from posts.models import User
+from posts.rebalance import balance_plan, move_authors, stray_authors
+from posts.sharding import shard_aliases
+
+
+class Command(BaseCommand):
+    help = ('Переносит авторов с их постами и комментариями между шардами. '
+            'Сайт можно не останавливать: строки удаляются со старого шарда '
+            'только после того, как истечёт SHARD_PLACEMENT_TTL и записи, '
+            'сделанные за это время, будут скопированы')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--author', help='Имя пользователя автора')
+        parser.add_argument('--to', help='Шард назначения')
+        parser.add_argument('--auto', action='store_true',
+                            help='Выровнять шарды по числу постов')
+        parser.add_argument('--sweep', action='store_true',
+                            help='Перенести строки, оставшиеся не на своём '
+                                 'шарде')
+        parser.add_argument('--wait', type=float,
+                            default=settings.SHARD_PLACEMENT_TTL + 1,
+                            help='Сколько секунд ждать, пока все воркеры '
+                                 'увидят новый шард')
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        aliases = shard_aliases()
+        if len(aliases) == 1:
+            raise CommandError('Шардирование выключено: POSTS_SHARDS=1')
+
+        if not (options['author'] or options['auto'] or options['sweep']):
+            raise CommandError('Укажите --author и --to, --auto или --sweep')
+
+        moves = []
+        if options['author']:
+            if options['to'] not in aliases:
+                raise CommandError(f'--to должен быть одним из: '
+                                   f'{", ".join(aliases)}')
+            try:
+                author = User.objects.get(username=options['author'])
+            except User.DoesNotExist:
+                raise CommandError('Автор не найден')
+            moves.append((author.pk, None, options['to']))
+        if options['auto']:
+            moves += balance_plan()
+        if options['sweep']:
+            moves += list(stray_authors())
+
+        for author_id, source, target in moves:
+            self.stdout.write(f'Автор {author_id}: {source or "текущий"} '
+                              f'-> {target}')
+        if not options['dry_run']:
+            for author_id, copied in move_authors(moves, options['wait']):
+                self.stdout.write(f'Автор {author_id}: перенесено строк: '
+                                  f'{copied}')
+        self.stdout.write(self.style.SUCCESS(f'Переносов: {len(moves)}'))
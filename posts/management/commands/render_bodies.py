@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+
+from posts.models import ArchivedComment, ArchivedPost, Comment, Post
+from posts.rendering import render_bodies
+from posts.sharding import shard_aliases
+
+MODELS = ((Post, True), (ArchivedPost, True),
+          (Comment, False), (ArchivedComment, False))
+
+
+class Command(BaseCommand):
+    help = 'Заполняет HTML постов и комментариев, сохранённых без него'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--all', action='store_true',
+                            help='Перерисовать и уже заполненные записи')
+
+    def handle(self, *args, **options):
+        for model, link_tags in MODELS:
+            total = 0
+            for alias in shard_aliases():
+                queryset = model.objects.using(alias).order_by('id')
+                if not options['all']:
+                    queryset = queryset.filter(text_html='')
+                last_id = 0
+                while True:
+                    batch = list(queryset.filter(id__gt=last_id)
+                                 .only('id', 'text')
+                                 [:options['batch_size']])
+                    if not batch:
+                        break
+                    bodies = render_bodies([obj.text for obj in batch],
+                                           link_tags)
+                    for obj, body in zip(batch, bodies):
+                        obj.text_html = body
+                    model.objects.using(alias).bulk_update(batch,
+                                                           ['text_html'])
+                    last_id = batch[-1].id
+                    total += len(batch)
+            self.stdout.write(f'{model._meta.verbose_name_plural}: {total}')
@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from posts.rollups import rollup_batch, rollup_sources
+
+
+class Command(BaseCommand):
+    help = ('Добавляет в дневные итоги посты, комментарии и подписки, '
+            'появившиеся после прошлого запуска')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int,
+                            default=settings.ROLLUP_BATCH_SIZE)
+        parser.add_argument('--lag', type=int, default=settings.ROLLUP_LAG,
+                            help='Не трогать записи моложе N секунд')
+
+    def handle(self, *args, **options):
+        for metric, alias in rollup_sources():
+            total = 0
+            while True:
+                processed = rollup_batch(metric, alias,
+                                         options['batch_size'],
+                                         options['lag'])
+                if not processed:
+                    break
+                total += processed
+            self.stdout.write(f'{metric}@{alias}: {total}')
@@ -0,0 +1,52 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from posts.warmup import shared_cache, warm
+
+
+class Command(BaseCommand):
+    help = ('Прогревает кеш: первые страницы ленты, активные группы, '
+            'популярные профили и их миниатюры. Страницы прогреваются, '
+            'только если кеш общий для всех процессов; с локальным кешем '
+            '(LocMemCache) — только миниатюры')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', type=int,
+                            default=settings.WARM_CACHE_PAGES)
+        parser.add_argument('--groups', type=int,
+                            default=settings.WARM_CACHE_GROUPS)
+        parser.add_argument('--profiles', type=int,
+                            default=settings.WARM_CACHE_PROFILES)
+        parser.add_argument('--workers', type=int,
+                            default=settings.WARM_CACHE_WORKERS)
+        parser.add_argument('--budget', type=float,
+                            default=settings.WARM_CACHE_BUDGET,
+                            help='Ограничение по времени, в секундах')
+
+    def handle(self, *args, **options):
+        thumbnails_only = not shared_cache()
+        if thumbnails_only:
+            self.stdout.write(self.style.WARNING(
+                'Кеш локальный для процесса и пропадёт вместе с командой: '
+                'прогреваются только миниатюры'))
+        results, skipped, elapsed = warm(options['pages'],
+                                         options['groups'],
+                                         options['profiles'],
+                                         options['workers'],
+                                         options['budget'],
+                                         thumbnails_only)
+
+        for kind, target, seconds, error in results:
+            line = f'{kind:<9} {target} {seconds * 1000:.0f} мс'
+            if error:
+                self.stdout.write(self.style.ERROR(f'{line} ошибка: {error}'))
+            else:
+                self.stdout.write(line)
+        for kind, target in skipped:
+            self.stdout.write(self.style.WARNING(
+                f'{kind:<9} {target} не успели'))
+
+        warmed = sum(1 for result in results if not result[3])
+        self.stdout.write(self.style.SUCCESS(
+            f'Прогрето: {warmed}, ошибок: {len(results) - warmed}, '
+            f'пропущено: {len(skipped)}, время: {elapsed:.2f} с'))
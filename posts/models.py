@@ -1,5 +1,8 @@
 from django.contrib.auth import get_user_model
-from django.db import models
+from django.db import models, router, transaction
+
+from .sharding import ShardedQuerySet
+from .storage import ContentAddressedStorage, references
 
 User = get_user_model()
 
@@ -18,28 +21,49 @@ class Group(models.Model):
 
 
 class Post(models.Model):
+    archived = False
+
     text = models.TextField(verbose_name='Текст публикации')
+    text_html = models.TextField(blank=True, editable=False,
+                                 verbose_name='HTML публикации')
     pub_date = models.DateTimeField(auto_now_add=True,
                                     verbose_name='Дата публикации')
     author = models.ForeignKey(User,
-                               on_delete=models.CASCADE,
+                               on_delete=models.DO_NOTHING,
+                               db_constraint=False,
                                related_name='posts',
                                verbose_name='Автор')
     group = models.ForeignKey(Group,
                               blank=True,
                               null=True,
-                              on_delete=models.SET_NULL,
+                              on_delete=models.DO_NOTHING,
+                              db_constraint=False,
                               related_name='group_posts',
                               verbose_name='Группа')
-    image = models.ImageField(upload_to='posts/', blank=True, null=True)
+    image = models.ImageField(upload_to='posts/',
+                              storage=ContentAddressedStorage(),
+                              blank=True,
+                              null=True)
+
+    objects = ShardedQuerySet.as_manager()
 
     def __str__(self):
         return self.text[:20]
 
+    def save(self, *args, using=None, **kwargs):
+        # In a savepoint, so a failed save is rolled back before the image
+        # references taken by the storage are given back.
+        using = using or router.db_for_write(Post, instance=self)
+        with references(using), transaction.atomic(using=using):
+            super().save(*args, using=using, **kwargs)
+
     class Meta:
         verbose_name = 'Пост'
         verbose_name_plural = 'Посты'
         ordering = ('-pub_date',)
+        indexes = [models.Index(fields=('pub_date',)),
+                   models.Index(fields=('author', '-pub_date')),
+                   models.Index(fields=('group', '-pub_date'))]
 
 
 class Comment(models.Model):
@@ -48,12 +72,17 @@ class Comment(models.Model):
                              related_name='comments',
                              verbose_name='Пост')
     author = models.ForeignKey(User,
-                               on_delete=models.CASCADE,
+                               on_delete=models.DO_NOTHING,
+                               db_constraint=False,
                                related_name='comments',
                                verbose_name='Автор')
     text = models.TextField(verbose_name='Текст комментария')
+    text_html = models.TextField(blank=True, editable=False,
+                                 verbose_name='HTML комментария')
     created = models.DateTimeField(auto_now_add=True,
                                    verbose_name='Дата публикации')
+    objects = ShardedQuerySet.as_manager()
+
     def __str__(self):
         return self.text[:20]
 
@@ -72,7 +101,228 @@ class Follow(models.Model):
                                on_delete=models.CASCADE,
                                related_name='following',
                                verbose_name='Автор')
+    created = models.DateTimeField(auto_now_add=True, null=True,
+                                   verbose_name='Дата подписки')
 
     class Meta:
         verbose_name = 'Подписчик'
-        verbose_name_plural = 'Подписчики'
\ No newline at end of file
+        verbose_name_plural = 'Подписчики'
+
+
+class GroupSubscription(models.Model):
+    user = models.ForeignKey(User,
+                             on_delete=models.CASCADE,
+                             related_name='group_subscriptions',
+                             verbose_name='Подписчик')
+    group = models.ForeignKey(Group,
+                              on_delete=models.CASCADE,
+                              related_name='subscribers',
+                              verbose_name='Группа')
+
+    class Meta:
+        verbose_name = 'Подписка на группу'
+        verbose_name_plural = 'Подписки на группы'
+        constraints = [
+            models.UniqueConstraint(fields=('user', 'group'),
+                                    name='unique_group_subscription')]
+
+
+class Tag(models.Model):
+    name = models.CharField(max_length=100,
+                            unique=True,
+                            verbose_name='Тег')
+    post_count = models.IntegerField(default=0,
+                                     db_index=True,
+                                     verbose_name='Количество постов')
+
+    def __str__(self):
+        return self.name
+
+    class Meta:
+        verbose_name = 'Тег'
+        verbose_name_plural = 'Теги'
+
+
+class PostTag(models.Model):
+    post = models.ForeignKey(Post,
+                             on_delete=models.CASCADE,
+                             related_name='post_tags',
+                             verbose_name='Пост')
+    tag = models.ForeignKey(Tag,
+                            on_delete=models.DO_NOTHING,
+                            db_constraint=False,
+                            related_name='post_tags',
+                            verbose_name='Тег')
+    pub_date = models.DateTimeField(verbose_name='Дата публикации')
+
+    objects = ShardedQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Тег поста'
+        verbose_name_plural = 'Теги постов'
+        constraints = [models.UniqueConstraint(fields=('post', 'tag'),
+                                               name='unique_post_tag')]
+        indexes = [models.Index(fields=('tag', '-pub_date'))]
+
+
+class ArchivedPost(models.Model):
+    archived = True
+
+    id = models.IntegerField(primary_key=True)
+    text = models.TextField(verbose_name='Текст публикации')
+    text_html = models.TextField(blank=True, editable=False,
+                                 verbose_name='HTML публикации')
+    pub_date = models.DateTimeField(verbose_name='Дата публикации')
+    author = models.ForeignKey(User,
+                               on_delete=models.DO_NOTHING,
+                               db_constraint=False,
+                               related_name='archived_posts',
+                               verbose_name='Автор')
+    group = models.ForeignKey(Group,
+                              blank=True,
+                              null=True,
+                              on_delete=models.DO_NOTHING,
+                              db_constraint=False,
+                              related_name='archived_posts',
+                              verbose_name='Группа')
+    image = models.ImageField(upload_to='posts/',
+                              storage=ContentAddressedStorage(),
+                              blank=True,
+                              null=True)
+    archived_at = models.DateTimeField(auto_now_add=True,
+                                       verbose_name='Дата архивации')
+
+    objects = ShardedQuerySet.as_manager()
+
+    def __str__(self):
+        return self.text[:20]
+
+    class Meta:
+        verbose_name = 'Архивный пост'
+        verbose_name_plural = 'Архивные посты'
+        ordering = ('-pub_date',)
+        indexes = [models.Index(fields=('author', '-pub_date'))]
+
+
+class ArchivedComment(models.Model):
+    id = models.IntegerField(primary_key=True)
+    post = models.ForeignKey(ArchivedPost,
+                             on_delete=models.CASCADE,
+                             related_name='comments',
+                             verbose_name='Пост')
+    author = models.ForeignKey(User,
+                               on_delete=models.DO_NOTHING,
+                               db_constraint=False,
+                               related_name='archived_comments',
+                               verbose_name='Автор')
+    text = models.TextField(verbose_name='Текст комментария')
+    text_html = models.TextField(blank=True, editable=False,
+                                 verbose_name='HTML комментария')
+    created = models.DateTimeField(verbose_name='Дата публикации')
+
+    objects = ShardedQuerySet.as_manager()
+
+    def __str__(self):
+        return self.text[:20]
+
+    class Meta:
+        verbose_name = 'Архивный комментарий'
+        verbose_name_plural = 'Архивные комментарии'
+        ordering = ('created',)
+
+
+class ImageBlob(models.Model):
+    name = models.CharField(max_length=255,
+                            unique=True,
+                            verbose_name='Файл')
+    refs = models.IntegerField(default=0,
+                               verbose_name='Количество ссылок')
+
+    def __str__(self):
+        return self.name
+
+    class Meta:
+        verbose_name = 'Изображение'
+        verbose_name_plural = 'Изображения'
+
+
+class ProfileRecord(models.Model):
+    key = models.CharField(max_length=32,
+                           unique=True,
+                           verbose_name='Ключ')
+    created = models.DateTimeField(auto_now_add=True,
+                                   verbose_name='Дата')
+    user = models.ForeignKey(User,
+                             blank=True,
+                             null=True,
+                             on_delete=models.SET_NULL,
+                             related_name='profile_records',
+                             verbose_name='Пользователь')
+    method = models.CharField(max_length=10, verbose_name='Метод')
+    path = models.CharField(max_length=500, verbose_name='Адрес')
+    status_code = models.PositiveSmallIntegerField(verbose_name='Статус')
+    duration = models.FloatField(verbose_name='Время, с')
+    query_count = models.PositiveIntegerField(verbose_name='Запросов к БД')
+    query_time = models.FloatField(verbose_name='Время запросов, с')
+
+    def __str__(self):
+        return f'{self.method} {self.path}'
+
+    class Meta:
+        verbose_name = 'Профиль запроса'
+        verbose_name_plural = 'Профили запросов'
+        ordering = ('-created',)
+
+
+class ShardPlacement(models.Model):
+    author = models.OneToOneField(User,
+                                  on_delete=models.CASCADE,
+                                  related_name='shard_placement',
+                                  verbose_name='Автор')
+    alias = models.CharField(max_length=50, verbose_name='Шард')
+
+    def __str__(self):
+        return f'{self.author_id} -> {self.alias}'
+
+    class Meta:
+        verbose_name = 'Размещение автора'
+        verbose_name_plural = 'Размещения авторов'
+
+
+class DailyRollup(models.Model):
+    METRICS = (('posts', 'Посты'),
+               ('comments', 'Комментарии'),
+               ('follows', 'Подписки'))
+    DIMENSIONS = (('site', 'Весь сайт'),
+                  ('group', 'Группа'),
+                  ('author', 'Автор'))
+
+    day = models.DateField(verbose_name='День')
+    metric = models.CharField(max_length=16, choices=METRICS,
+                              verbose_name='Показатель')
+    dimension = models.CharField(max_length=16, choices=DIMENSIONS,
+                                 verbose_name='Разрез')
+    key = models.IntegerField(default=0,
+                              verbose_name='Группа или автор')
+    count = models.IntegerField(default=0, verbose_name='Количество')
+
+    class Meta:
+        verbose_name = 'Дневной итог'
+        verbose_name_plural = 'Дневные итоги'
+        ordering = ('day',)
+        constraints = [
+            models.UniqueConstraint(fields=('metric', 'dimension', 'key',
+                                            'day'),
+                                    name='unique_daily_rollup')]
+        indexes = [models.Index(fields=('metric', 'dimension', 'day'))]
+
+
+class RollupWatermark(models.Model):
+    source = models.CharField(max_length=64, unique=True,
+                              verbose_name='Источник')
+    last_id = models.BigIntegerField(default=0,
+                                     verbose_name='Последний id')
+
+    class Meta:
+        verbose_name = 'Отметка агрегации'
+        verbose_name_plural = 'Отметки агрегации'
@@ -0,0 +1,58 @@
+import datetime as dt
+import heapq
+from itertools import islice
+from operator import attrgetter
+
+from django.db.models import Q
+
+PAGE_SIZE = 10
+
+
+def encode_cursor(pub_date, pk):
+    micros = int(pub_date.timestamp()) * 10 ** 6 + pub_date.microsecond
+    return f'{micros}_{pk}'
+
+
+def decode_cursor(value):
+    try:
+        micros, pk = (int(part) for part in value.split('_'))
+        pub_date = dt.datetime.fromtimestamp(micros // 10 ** 6,
+                                             tz=dt.timezone.utc)
+    except (AttributeError, ValueError, OverflowError, OSError):
+        return None
+    return pub_date.replace(microsecond=micros % 10 ** 6), pk
+
+
+def keyset_filter(queryset, cursor, date_field='pub_date', id_field='id'):
+    if cursor is None:
+        return queryset
+    pub_date, pk = cursor
+    return queryset.filter(
+        Q(**{f'{date_field}__lt': pub_date})
+        | Q(**{date_field: pub_date, f'{id_field}__lt': pk}))
+
+
+def unique_rows(rows, key):
+    # Rows from different sources with the same key are the same post and
+    # come out of the merge next to each other.
+    last = None
+    for row in rows:
+        if key(row) != last:
+            last = key(row)
+            yield row
+
+
+def keyset_page(querysets, cursor, size=PAGE_SIZE, date_field='pub_date',
+                id_field='id'):
+    """Merge querysets sorted newest first, reading size + 1 rows from each."""
+    key = attrgetter(date_field, id_field)
+    parts = [list(keyset_filter(queryset, cursor, date_field, id_field)
+                  .order_by(f'-{date_field}', f'-{id_field}')[:size + 1])
+             for queryset in querysets]
+    rows = list(islice(unique_rows(heapq.merge(*parts, key=key, reverse=True),
+                                   key),
+                       size + 1))
+    if len(rows) <= size:
+        return rows, None
+    rows = rows[:size]
+    return rows, encode_cursor(*key(rows[-1]))
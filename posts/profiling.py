@@ -0,0 +1,182 @@
+import json
+import marshal
+import os
+import sys
+import threading
+import time
+import traceback
+import uuid
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.db import connections
+from django.template.base import Template
+
+from .models import ProfileRecord
+
+ARTIFACTS = ('pstats', 'collapsed', 'json')
+
+_local = threading.local()
+_patch_lock = threading.Lock()
+_patch_users = 0
+_original_render = Template.render
+
+
+def profile_storage():
+    return FileSystemStorage(location=settings.PROFILER_ROOT)
+
+
+def _timed_render(self, context):
+    profile = getattr(_local, 'profile', None)
+    if profile is None:
+        return _original_render(self, context)
+    started = time.perf_counter()
+    try:
+        return _original_render(self, context)
+    finally:
+        profile.templates.append({
+            'name': self.origin.template_name or self.origin.name,
+            'time': time.perf_counter() - started,
+        })
+
+
+@contextmanager
+def _template_timing(profile):
+    global _patch_users
+    with _patch_lock:
+        if _patch_users == 0:
+            Template.render = _timed_render
+        _patch_users += 1
+    _local.profile = profile
+    try:
+        yield
+    finally:
+        _local.profile = None
+        with _patch_lock:
+            _patch_users -= 1
+            if _patch_users == 0:
+                Template.render = _original_render
+
+
+def _origin():
+    for frame in reversed(traceback.extract_stack()):
+        if (frame.filename.startswith(settings.BASE_DIR)
+                and 'site-packages' not in frame.filename
+                and frame.filename != __file__):
+            path = os.path.relpath(frame.filename, settings.BASE_DIR)
+            return f'{path}:{frame.lineno} in {frame.name}'
+    return ''
+
+
+class Sampler(threading.Thread):
+    def __init__(self, thread_id, interval):
+        super().__init__(name='profiler-sampler', daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                module = os.path.splitext(
+                    os.path.basename(frame.f_code.co_filename))[0]
+                stack.append(f'{module}:{frame.f_code.co_name}')
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+
+class RequestProfile:
+    def __init__(self):
+        self.queries = []
+        self.templates = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({
+                'alias': context['connection'].alias,
+                'sql': sql,
+                'params': repr(params),
+                'time': time.perf_counter() - started,
+                'origin': _origin(),
+            })
+
+
+def is_triggered(request):
+    param = settings.PROFILER_TRIGGER_PARAM
+    if param in request.META.get('QUERY_STRING', ''):
+        return param in request.GET
+    return settings.PROFILER_HEADER in request.META
+
+
+def profile_request(request, get_response):
+    import cProfile
+
+    profile = RequestProfile()
+    profiler = cProfile.Profile()
+    sampler = Sampler(threading.get_ident(),
+                      settings.PROFILER_SAMPLE_INTERVAL)
+
+    started = time.perf_counter()
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(profile))
+        stack.enter_context(_template_timing(profile))
+        sampler.start()
+        profiler.enable()
+        try:
+            response = get_response(request)
+        finally:
+            profiler.disable()
+            sampler.stop()
+    duration = time.perf_counter() - started
+
+    save_profile(request, response, duration, profiler, sampler, profile)
+    return response
+
+
+def save_profile(request, response, duration, profiler, sampler, profile):
+    key = uuid.uuid4().hex
+    profiler.create_stats()
+    storage = profile_storage()
+    storage.save(f'{key}.pstats', ContentFile(marshal.dumps(profiler.stats)))
+    storage.save(f'{key}.collapsed', ContentFile(''.join(
+        f'{stack} {count}\n' for stack, count in sampler.stacks.items())))
+    storage.save(f'{key}.json', ContentFile(json.dumps({
+        'queries': profile.queries,
+        'templates': profile.templates,
+    }, indent=1)))
+
+    return ProfileRecord.objects.create(
+        key=key,
+        method=request.method,
+        path=request.get_full_path()[:500],
+        user=request.user,
+        status_code=response.status_code,
+        duration=duration,
+        query_count=len(profile.queries),
+        query_time=sum(query['time'] for query in profile.queries),
+    )
+
+
+class ProfilerMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not is_triggered(request) or not request.user.is_staff:
+            return self.get_response(request)
+        return profile_request(request, self.get_response)
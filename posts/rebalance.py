@@ -0,0 +1,215 @@
+import logging
+import time
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Count
+
+from .models import (ArchivedComment, ArchivedPost, Comment, Post, PostTag,
+                     ShardPlacement)
+from .sharding import (placement_cache, reseed_sequences, shard_aliases,
+                       shard_for)
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+
+
+def _author_querysets(alias, author_id):
+    return [
+        Post.objects.using(alias).filter(author_id=author_id),
+        Comment.objects.using(alias).filter(post__author_id=author_id),
+        PostTag.objects.using(alias).filter(post__author_id=author_id),
+        ArchivedPost.objects.using(alias).filter(author_id=author_id),
+        ArchivedComment.objects.using(alias).filter(
+            post__author_id=author_id),
+    ]
+
+
+# Children first, so deleting parents never trips a foreign key.
+DELETE_ORDER = (ArchivedComment, ArchivedPost, PostTag, Comment, Post)
+
+
+def _fingerprint(row):
+    return hash(tuple(sorted(row.items())))
+
+
+def _create(model, alias, rows):
+    """bulk_create the rows as they are: it would stamp auto_now_add
+    fields with the current time, so their values are written back."""
+    objs = [model(**row) for row in rows]
+    model.objects.using(alias).bulk_create(objs, ignore_conflicts=True)
+    stamped = [field.attname for field in model._meta.concrete_fields
+               if getattr(field, 'auto_now_add', False)]
+    if objs and stamped:
+        for obj, row in zip(objs, rows):
+            for name in stamped:
+                setattr(obj, name, row[name])
+        model.objects.using(alias).bulk_update(objs, stamped)
+
+
+def copy_author(author_id, source, target, copied):
+    """Copy the author's rows the target is missing and return their count.
+
+    copied maps each model to {pk: fingerprint} of the rows copied so far
+    and is updated in place. A copied row that changed on the source since
+    is copied again, unless it has changed on the target as well.
+    """
+    count = 0
+    with transaction.atomic(using=target):
+        for queryset in _author_querysets(source, author_id):
+            model = queryset.model
+            seen = copied.setdefault(model, {})
+            batch = []
+            for row in queryset.order_by('pk').values().iterator(BATCH_SIZE):
+                fingerprint = _fingerprint(row)
+                previous = seen.get(row['id'])
+                if previous == fingerprint:
+                    continue
+                seen[row['id']] = fingerprint
+                count += 1
+                if previous is None:
+                    batch.append(row)
+                    if len(batch) == BATCH_SIZE:
+                        _create(model, target, batch)
+                        batch = []
+                    continue
+                rows = model.objects.using(target).filter(pk=row['id'])
+                current = rows.values().first()
+                if current is None or _fingerprint(current) == previous:
+                    rows.update(**row)
+                else:
+                    logger.warning('%s %s changed on both %s and %s, '
+                                   'keeping the %s copy',
+                                   model.__name__, row['id'], source, target,
+                                   target)
+            _create(model, target, batch)
+    return count
+
+
+def delete_rows(rows, alias):
+    """Delete exactly the given {model: pks}, without cascading."""
+    with transaction.atomic(using=alias):
+        with connections[alias].cursor() as cursor:
+            for model in DELETE_ORDER:
+                table = model._meta.db_table
+                pks = list(rows.get(model, ()))
+                for start in range(0, len(pks), BATCH_SIZE):
+                    chunk = pks[start:start + BATCH_SIZE]
+                    placeholders = ', '.join(['%s'] * len(chunk))
+                    cursor.execute(f'DELETE FROM {table} '
+                                   f'WHERE id IN ({placeholders})', chunk)
+
+
+class AuthorMove:
+    """Move of one author's rows from the source shard to the target.
+
+    start() copies the rows and points the placement at the target. Other
+    workers keep writing to the source until their cached placement
+    expires, so finish() is called SHARD_PLACEMENT_TTL later: it copies
+    what arrived in between and only then deletes the copied rows.
+    """
+
+    def __init__(self, author_id, source, target):
+        self.author_id = author_id
+        self.source = source
+        self.target = target
+        self.copied = {}
+        self.count = 0
+
+    def start(self):
+        self.count += copy_author(self.author_id, self.source, self.target,
+                                  self.copied)
+        # Before any write on the target: copied ids may be above its
+        # sequence.
+        reseed_sequences(self.target)
+        ShardPlacement.objects.update_or_create(
+            author_id=self.author_id, defaults={'alias': self.target})
+        placement_cache.clear()
+
+    def dropped(self):
+        """Copied rows that have since been deleted on the source."""
+        dropped = {}
+        for queryset in _author_querysets(self.source, self.author_id):
+            present = set(queryset.values_list('pk', flat=True))
+            dropped[queryset.model] = [
+                pk for pk in self.copied.get(queryset.model, ())
+                if pk not in present]
+        return dropped
+
+    def finish(self):
+        while True:
+            copied = copy_author(self.author_id, self.source, self.target,
+                                 self.copied)
+            self.count += copied
+            if not copied:
+                break
+        reseed_sequences(self.target)
+        delete_rows(self.dropped(), self.target)
+        # Only what was copied: a row written to the source after the last
+        # pass stays there for --sweep instead of being lost.
+        delete_rows(self.copied, self.source)
+        return self.count
+
+
+def move_authors(moves, wait=None):
+    """Move (author_id, source, target) triples; a None source is the
+    author's current shard. Returns (author_id, rows copied) pairs."""
+    wait = settings.SHARD_PLACEMENT_TTL + 1 if wait is None else wait
+    started = []
+    for author_id, source, target in moves:
+        source = source or shard_for(author_id)
+        if source != target:
+            move = AuthorMove(author_id, source, target)
+            move.start()
+            started.append(move)
+    if started:
+        time.sleep(wait)
+    return [(move.author_id, move.finish()) for move in started]
+
+
+
+def author_loads():
+    loads = {}
+    for alias in shard_aliases():
+        loads[alias] = dict(Post.objects.using(alias).order_by()
+                            .values_list('author_id')
+                            .annotate(posts=Count('id')))
+    return loads
+
+
+def balance_plan(tolerance=0.1):
+    loads = author_loads()
+    totals = {alias: sum(authors.values()) for alias, authors in loads.items()}
+    plan = []
+    while True:
+        heaviest = max(totals, key=totals.get)
+        lightest = min(totals, key=totals.get)
+        gap = totals[heaviest] - totals[lightest]
+        if gap <= tolerance * max(sum(totals.values()), 1):
+            break
+        candidates = [(posts, author_id)
+                      for author_id, posts in loads[heaviest].items()
+                      if posts <= gap / 2]
+        if not candidates:
+            break
+        posts, author_id = max(candidates)
+        del loads[heaviest][author_id]
+        loads[lightest][author_id] = posts
+        totals[heaviest] -= posts
+        totals[lightest] += posts
+        plan.append((author_id, heaviest, lightest))
+    return plan
+
+
+def stray_authors():
+    placement_cache.clear()
+    for alias in shard_aliases():
+        authors = set()
+        for model in (Post, ArchivedPost):
+            authors.update(model.objects.using(alias).order_by()
+                           .values_list('author_id', flat=True).distinct())
+        for author_id in sorted(authors):
+            target = shard_for(author_id)
+            if target != alias:
+                yield author_id, alias, target
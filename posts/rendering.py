@@ -0,0 +1,59 @@
+import re
+
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+from django.utils.html import escape
+from django.utils.text import normalize_newlines
+
+from .tags import TAG_RE, extract_tags
+
+URL_RE = r'https?://[^\s<>"]*[^\s<>".,:;!?\'()\[\]]'
+MENTION_RE = r'(?<![\w@])@([\w.@+-]*\w)'
+TOKEN_RE = re.compile(rf'(?P<url>{URL_RE})|(?P<mention>{MENTION_RE})'
+                      rf'|(?P<tag>{TAG_RE.pattern})')
+
+
+def mentioned_usernames(texts):
+    names = {match.group('mention')[1:]
+             for text in texts for match in TOKEN_RE.finditer(text)
+             if match.group('mention')}
+    if not names:
+        return set()
+    return set(get_user_model().objects.filter(username__in=names)
+               .values_list('username', flat=True))
+
+
+def _text(value):
+    return escape(value).replace('\n', '<br>')
+
+
+def render_body(text, usernames, link_tags=True):
+    """Body as linebreaksbr would render it, plus links for URLs, hashtags
+    and mentions of the given usernames."""
+    text = normalize_newlines(text)
+    tags = extract_tags(text) if link_tags else set()
+    parts = []
+    position = 0
+    for match in TOKEN_RE.finditer(text):
+        token = match.group()
+        kind = match.lastgroup
+        if kind == 'url':
+            link = f'<a href="{escape(token)}" rel="nofollow">'
+        elif kind == 'mention' and token[1:] in usernames:
+            link = f'<a href="{reverse("profile", args=[token[1:]])}">'
+        elif kind == 'tag' and token[1:].lower() in tags:
+            link = (f'<a href="'
+                    f'{reverse("tag_posts", args=[token[1:].lower()])}">')
+        else:
+            continue
+        parts.append(_text(text[position:match.start()]))
+        parts.append(f'{link}{escape(token)}</a>')
+        position = match.end()
+    parts.append(_text(text[position:]))
+    return ''.join(parts)
+
+
+def render_bodies(texts, link_tags=True):
+    """Render many bodies with a single lookup of mentioned users."""
+    usernames = mentioned_usernames(texts)
+    return [render_body(text, usernames, link_tags) for text in texts]
@@ -0,0 +1,156 @@
+import hashlib
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+
+from .profiling import is_triggered
+
+logger = logging.getLogger(__name__)
+
+VERSION_PREFIX = 'surrogate:'
+
+
+def _version_keys(keys):
+    return {f'{VERSION_PREFIX}{key}': key for key in keys}
+
+
+def current_versions(keys):
+    names = _version_keys(keys)
+    versions = cache.get_many(names)
+    for name in names.keys() - versions.keys():
+        # A fresh value rather than 0, so a counter that was evicted and
+        # recreated never matches a version stored before the eviction.
+        cache.add(name, time.time_ns(), None)
+    if len(versions) < len(names):
+        versions = cache.get_many(names)
+    return {names[name]: version for name, version in versions.items()}
+
+
+def bump(keys):
+    for name in _version_keys(keys):
+        try:
+            cache.incr(name)
+        except ValueError:
+            cache.set(name, time.time_ns(), None)
+
+
+def purge_proxy(keys):
+    url = settings.RESPONSE_CACHE_PURGE_URL
+    if not url:
+        return
+    import urllib.request
+
+    request = urllib.request.Request(
+        url, method='PURGE', headers={'Surrogate-Key': ' '.join(keys)})
+    try:
+        urllib.request.urlopen(request, timeout=2).close()
+    except OSError as error:
+        logger.warning('Proxy purge of %s failed: %s', keys, error)
+
+
+def purge(keys, using=None):
+    """Invalidate responses tagged with any of the keys.
+
+    Bumped again after commit: a response rendered from the old rows
+    between the first bump and the commit would otherwise stay cached.
+    """
+    keys = sorted(set(keys))
+    bump(keys)
+
+    def after_commit():
+        bump(keys)
+        purge_proxy(keys)
+
+    transaction.on_commit(after_commit, using=using)
+
+
+def add_surrogate_keys(request, *keys):
+    """Tag the response being built; a no-op unless it can be cached.
+
+    Call it before reading the data the keys stand for, so that a purge
+    racing with the view leaves a stale version behind.
+    """
+    tagged = getattr(request, 'surrogate_keys', None)
+    if tagged is None:
+        return
+    new = [key for key in keys if key not in tagged]
+    if new:
+        tagged.update(current_versions(new))
+
+
+def listed_keys(posts):
+    """Keys for the author names and group titles shown next to the posts."""
+    for post in posts:
+        yield f'user:{post.author_id}'
+        if post.group_id is not None:
+            yield f'group:{post.group.slug}'
+
+
+def user_keys(items):
+    """Keys for the names of the authors of comments and the like."""
+    return {f'user:{item.author_id}' for item in items}
+
+
+def versions_digest(keys):
+    """Current versions of the keys in one short string, so a fragment
+    cached under it is dropped with any of them."""
+    versions = sorted(current_versions(set(keys)).items())
+    return hashlib.md5(repr(versions).encode()).hexdigest()
+
+
+def is_cacheable(request):
+    return (request.method == 'GET'
+            and settings.SESSION_COOKIE_NAME not in request.COOKIES
+            and 'messages' not in request.COOKIES
+            and not is_triggered(request))
+
+
+def response_key(request):
+    url = request.build_absolute_uri()
+    return f'response:{hashlib.md5(url.encode()).hexdigest()}'
+
+
+class ResponseCacheMiddleware:
+    """Full-page cache for anonymous GETs of views that add surrogate keys."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not is_cacheable(request):
+            return self.get_response(request)
+
+        key = response_key(request)
+        entry = cache.get(key)
+        if entry is not None and (current_versions(entry['versions'])
+                                  == entry['versions']):
+            response = HttpResponse(entry['content'],
+                                    status=entry['status'])
+            for header, value in entry['headers']:
+                response[header] = value
+            response['X-Cache'] = 'HIT'
+            return response
+
+        request.surrogate_keys = {}
+        response = self.get_response(request)
+        if (request.surrogate_keys and response.status_code == 200
+                and not response.streaming and not response.cookies):
+            response['Cache-Control'] = (
+                f'public, max-age=0, '
+                f's-maxage={settings.RESPONSE_CACHE_TIMEOUT}')
+            # A shared proxy must not hand this page to a logged-in user.
+            patch_vary_headers(response, ('Cookie',))
+            response['Surrogate-Key'] = ' '.join(
+                sorted(request.surrogate_keys))
+            cache.set(key, {'content': response.content,
+                            'status': response.status_code,
+                            'headers': list(response.items()),
+                            'versions': request.surrogate_keys},
+                      settings.RESPONSE_CACHE_TIMEOUT)
+            response['X-Cache'] = 'MISS'
+        return response
@@ -0,0 +1,121 @@
+import datetime as dt
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.utils import timezone
+
+from .models import (Comment, DailyRollup, Follow, Group, Post,
+                     RollupWatermark, User)
+from .sharding import shard_aliases, shard_id_range
+
+EPOCH = dt.date(1970, 1, 1)
+SECONDS_PER_DAY = 24 * 60 * 60
+
+# metric: (model, date field, {dimension: column})
+SOURCES = {
+    'posts': (Post, 'pub_date', {'group': 'group_id',
+                                 'author': 'author_id'}),
+    'comments': (Comment, 'created', {'group': 'post__group_id',
+                                      'author': 'author_id'}),
+    'follows': (Follow, 'created', {'author': 'author_id'}),
+}
+
+
+def rollup_sources():
+    for metric, (model, _, _) in SOURCES.items():
+        aliases = (shard_aliases() if model in (Post, Comment)
+                   else [DEFAULT_DB_ALIAS])
+        for alias in aliases:
+            yield metric, alias
+
+
+def aggregate(columns, dimensions):
+    """Count rows per (dimension, day, key) from column-wise batches.
+
+    columns[0] holds timestamps, the rest the dimension keys in order.
+    """
+    import numpy as np
+
+    days = (np.asarray(columns[0], dtype=np.float64)
+            // SECONDS_PER_DAY).astype(np.int64)
+    day_numbers, counts = np.unique(days, return_counts=True)
+    totals = {('site', int(day), 0): int(count)
+              for day, count in zip(day_numbers, counts)}
+
+    for dimension, values in zip(dimensions, columns[1:]):
+        keys = np.array([value or 0 for value in values], dtype=np.int64)
+        present = keys != 0
+        pairs, counts = np.unique(
+            np.stack((days[present], keys[present]), axis=1),
+            axis=0, return_counts=True)
+        for (day, key), count in zip(pairs, counts):
+            totals[(dimension, int(day), int(key))] = int(count)
+    return totals
+
+
+def add_counts(metric, totals):
+    days = {EPOCH + dt.timedelta(days=day) for _, day, _ in totals}
+    existing = {(row.dimension, row.day, row.key): row
+                for row in DailyRollup.objects.filter(metric=metric,
+                                                      day__in=days)}
+    changed, created = [], []
+    for (dimension, day, key), count in totals.items():
+        day = EPOCH + dt.timedelta(days=day)
+        row = existing.get((dimension, day, key))
+        if row is None:
+            created.append(DailyRollup(day=day, metric=metric,
+                                       dimension=dimension, key=key,
+                                       count=count))
+        else:
+            row.count += count
+            changed.append(row)
+    DailyRollup.objects.bulk_update(changed, ['count'], batch_size=500)
+    DailyRollup.objects.bulk_create(created, batch_size=500)
+
+
+def rollup_batch(metric, alias, batch_size=None, lag=None):
+    """Fold the next batch of rows after the watermark into the rollups.
+
+    Rows younger than the lag are left for the next run, so a transaction
+    that commits late with a lower id is not skipped.
+    """
+    model, date_field, columns = SOURCES[metric]
+    batch_size = batch_size or settings.ROLLUP_BATCH_SIZE
+    lag = settings.ROLLUP_LAG if lag is None else lag
+    cutoff = timezone.now() - dt.timedelta(seconds=lag)
+
+    with transaction.atomic():
+        watermark, _ = RollupWatermark.objects.get_or_create(
+            source=f'{metric}@{alias}')
+        watermark = (RollupWatermark.objects.select_for_update()
+                     .get(pk=watermark.pk))
+        queryset = model.objects.using(alias).filter(
+            id__gt=watermark.last_id, **{f'{date_field}__lt': cutoff})
+        id_range = shard_id_range(alias) if model is not Follow else None
+        if id_range is not None:
+            # Rows moved in by rebalance_shards were counted on their
+            # original shard.
+            queryset = queryset.filter(id__gt=id_range[0],
+                                       id__lte=id_range[1])
+        rows = list(queryset.order_by('id')
+                    .values_list('id', date_field, *columns.values())
+                    [:batch_size])
+        if not rows:
+            return 0
+
+        ids, dates, *keys = zip(*rows)
+        timestamps = [date.timestamp() for date in dates]
+        add_counts(metric, aggregate([timestamps, *keys], list(columns)))
+        watermark.last_id = ids[-1]
+        watermark.save(update_fields=['last_id'])
+    return len(rows)
+
+
+def key_names(dimension, keys):
+    if dimension == 'group':
+        return dict(Group.objects.filter(id__in=keys)
+                    .values_list('id', 'title'))
+    if dimension == 'author':
+        return dict(User.objects.filter(id__in=keys)
+                    .values_list('id', 'username'))
+    return {0: 'Весь сайт'}
@@ -0,0 +1,276 @@
+import heapq
+import os
+import tempfile
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from itertools import islice
+from operator import attrgetter
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, models
+
+SHARDED_MODELS = {'post', 'comment', 'posttag', 'archivedpost',
+                  'archivedcomment'}
+ID_RANGE = 10 ** 12
+FEED_ORDER = ('-pub_date', '-id')
+
+
+def shard_aliases():
+    return settings.POSTS_SHARD_ALIASES
+
+
+def is_sharded(app_label, model_name):
+    return app_label == 'posts' and model_name in SHARDED_MODELS
+
+
+def hashed_shard_index(author_id, shards):
+    return zlib.crc32(str(author_id).encode()) % shards
+
+
+class PlacementCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._placements = {}
+
+    def get(self, author_id):
+        entry = self._placements.get(author_id)
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        return entry[1]
+
+    def set(self, author_id, alias):
+        expires = time.monotonic() + settings.SHARD_PLACEMENT_TTL
+        with self._lock:
+            self._placements[author_id] = (expires, alias)
+
+    def clear(self):
+        with self._lock:
+            self._placements.clear()
+
+
+placement_cache = PlacementCache()
+
+
+def shard_for(author_id, place=False):
+    aliases = shard_aliases()
+    if len(aliases) == 1:
+        return aliases[0]
+
+    alias = placement_cache.get(author_id)
+    if alias is not None:
+        return alias
+
+    from .models import ShardPlacement
+
+    alias = (ShardPlacement.objects.filter(author_id=author_id)
+             .values_list('alias', flat=True).first())
+    if alias is None:
+        alias = aliases[hashed_shard_index(author_id, len(aliases))]
+        if not place:
+            return alias
+        placement, _ = ShardPlacement.objects.get_or_create(
+            author_id=author_id, defaults={'alias': alias})
+        alias = placement.alias
+    placement_cache.set(author_id, alias)
+    return alias
+
+
+def authors_by_shard(author_ids):
+    """{alias: author ids}, looking up uncached placements in one query."""
+    aliases = shard_aliases()
+    if len(aliases) == 1:
+        return {aliases[0]: list(author_ids)} if author_ids else {}
+
+    from .models import ShardPlacement
+
+    placements = {author_id: placement_cache.get(author_id)
+                  for author_id in author_ids}
+    missing = [author_id for author_id, alias in placements.items()
+               if alias is None]
+    if missing:
+        found = dict(ShardPlacement.objects.filter(author_id__in=missing)
+                     .values_list('author_id', 'alias'))
+        for author_id in missing:
+            alias = found.get(author_id)
+            if alias is None:
+                alias = aliases[hashed_shard_index(author_id, len(aliases))]
+            else:
+                placement_cache.set(author_id, alias)
+            placements[author_id] = alias
+
+    grouped = {}
+    for author_id, alias in placements.items():
+        grouped.setdefault(alias, []).append(author_id)
+    return grouped
+
+
+def shard_of_post(post_id):
+    aliases = shard_aliases()
+    if len(aliases) == 1:
+        return aliases[0]
+    from .models import Post
+
+    for alias in aliases:
+        if Post.objects.using(alias).filter(id=post_id).exists():
+            return alias
+    return None
+
+
+class ShardRouter:
+    def _route(self, model, instance=None, **hints):
+        if not is_sharded(model._meta.app_label, model._meta.model_name):
+            return DEFAULT_DB_ALIAS
+        aliases = shard_aliases()
+        if len(aliases) == 1:
+            return aliases[0]
+        if instance is None:
+            return None
+        if instance._state.db in aliases:
+            return instance._state.db
+
+        model_name = instance._meta.model_name
+        if model_name in ('post', 'archivedpost'):
+            return shard_for(instance.author_id, place=True)
+        if model_name in ('comment', 'posttag', 'archivedcomment'):
+            post = instance._state.fields_cache.get('post')
+            if post is not None and post._state.db:
+                return post._state.db
+            return shard_of_post(instance.post_id)
+        if model_name == 'user':
+            return shard_for(instance.pk)
+        return None
+
+    def db_for_read(self, model, **hints):
+        return self._route(model, **hints)
+
+    def db_for_write(self, model, **hints):
+        return self._route(model, **hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        aliases = shard_aliases()
+        if len(aliases) == 1:
+            return None
+        if db in aliases:
+            return is_sharded(app_label, model_name)
+        return not is_sharded(app_label, model_name)
+
+
+def sharded(queryset, aliases=None):
+    aliases = shard_aliases() if aliases is None else aliases
+    return [queryset.using(alias) for alias in aliases]
+
+
+def merge_sorted(parts, key=attrgetter('pub_date', 'id')):
+    return heapq.merge(*parts, key=key, reverse=True)
+
+
+class ScatterGather:
+    def __init__(self, querysets, order=FEED_ORDER):
+        self.querysets = [queryset.order_by(*order)
+                          for queryset in querysets]
+        self.key = attrgetter(*(field.lstrip('-') for field in order))
+
+    def count(self):
+        if not hasattr(self, '_count'):
+            self._count = sum(queryset.count()
+                              for queryset in self.querysets)
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return list(self[index:index + 1])[0]
+        start, stop = index.start or 0, index.stop
+        parts = [list(queryset[:stop]) for queryset in self.querysets]
+        return list(islice(merge_sorted(parts, self.key), start, stop))
+
+
+def scatter(queryset, aliases=None):
+    querysets = sharded(queryset, aliases)
+    if len(querysets) == 1:
+        return querysets[0]
+    return ScatterGather(querysets)
+
+
+def shard_id_range(alias):
+    """Ids allocated on the shard itself; rows copied in keep foreign ids."""
+    aliases = shard_aliases()
+    if len(aliases) == 1:
+        return None
+    low = aliases.index(alias) * ID_RANGE
+    return low, low + ID_RANGE
+
+
+def reseed_sequences(alias):
+    id_range = shard_id_range(alias)
+    connection = connections[alias]
+    if id_range is None or connection.vendor != 'sqlite':
+        return
+
+    from .models import Comment, Post, PostTag
+
+    low = id_range[0]
+    with connection.cursor() as cursor:
+        for model in (Post, Comment, PostTag):
+            table = model._meta.db_table
+            cursor.execute(
+                f'SELECT MAX(id) FROM {table} WHERE id > %s AND id <= %s',
+                [low, low + ID_RANGE])
+            seq = cursor.fetchone()[0] or low
+            cursor.execute('DELETE FROM sqlite_sequence WHERE name = %s',
+                           [table])
+            cursor.execute('INSERT INTO sqlite_sequence (name, seq) '
+                           'VALUES (%s, %s)', [table, seq])
+
+
+def _reconnect(alias, settings_dict):
+    if hasattr(connections._connections, alias):
+        connections[alias].close()
+        delattr(connections._connections, alias)
+    if settings_dict is None:
+        connections.databases.pop(alias, None)
+    else:
+        connections.databases[alias] = settings_dict
+
+
+@contextmanager
+def temporary_databases(aliases):
+    """Point the aliases at fresh migrated SQLite files for the block,
+    adding the ones missing from DATABASES; benchmarks and tests seed them
+    instead of the configured databases. Migrations are routed by
+    POSTS_SHARD_ALIASES, so override it before entering.
+    """
+    from django.core.management import call_command
+
+    saved = {alias: connections.databases.get(alias) for alias in aliases}
+    with tempfile.TemporaryDirectory() as root:
+        try:
+            for alias in aliases:
+                _reconnect(alias, {
+                    'ENGINE': 'django.db.backends.sqlite3',
+                    'NAME': os.path.join(root, f'{alias}.sqlite3'),
+                    'OPTIONS': {'timeout': 60},
+                })
+                call_command('migrate', database=alias, verbosity=0)
+            placement_cache.clear()
+            yield
+        finally:
+            for alias, settings_dict in saved.items():
+                _reconnect(alias, settings_dict)
+            placement_cache.clear()
+
+
+class ShardedQuerySet(models.QuerySet):
+    def create(self, **kwargs):
+        # Without an explicit alias let the router place the new instance.
+        obj = self.model(**kwargs)
+        self._for_write = True
+        obj.save(force_insert=True, using=self._db)
+        return obj
@@ -0,0 +1,136 @@
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import (post_delete, post_migrate, post_save,
+                                      pre_delete, pre_save)
+from django.dispatch import receiver
+
+from . import response_cache, storage
+from .models import (ArchivedComment, ArchivedPost, Comment, Follow, Group,
+                     Post, PostTag, Tag, User)
+from .sharding import reseed_sequences, shard_aliases, sharded
+
+
+def _release_on_commit(name, using):
+    if name:
+        transaction.on_commit(lambda: storage.release(name), using=using)
+
+
+@receiver(pre_save, sender=Post)
+def remember_previous_state(sender, instance, **kwargs):
+    instance._replaced_image = None
+    instance._previous_group_id = None
+    if instance.pk is None:
+        return
+    old = (Post.objects.using(instance._state.db).filter(pk=instance.pk)
+           .values_list('image', 'group_id').first())
+    if old is None:
+        return
+    image, instance._previous_group_id = old
+    if image and image != instance.image.name:
+        instance._replaced_image = image
+
+
+@receiver(post_save, sender=Post)
+def release_replaced_image(sender, instance, using, **kwargs):
+    _release_on_commit(getattr(instance, '_replaced_image', None), using)
+
+
+@receiver(post_delete, sender=Post)
+def release_post_image(sender, instance, using, **kwargs):
+    if ArchivedPost.objects.using(using).filter(pk=instance.pk).exists():
+        return
+    _release_on_commit(instance.image.name, using)
+
+
+@receiver(post_delete, sender=ArchivedPost)
+def release_archived_post_image(sender, instance, using, **kwargs):
+    _release_on_commit(instance.image.name, using)
+
+
+@receiver(pre_delete, sender=Post)
+def decrement_tag_counts(sender, instance, using, **kwargs):
+    tag_ids = list(PostTag.objects.using(using).filter(post=instance)
+                   .values_list('tag_id', flat=True))
+    Tag.objects.filter(id__in=tag_ids).update(
+        post_count=F('post_count') - 1)
+
+
+@receiver(pre_delete, sender=User)
+def delete_sharded_user_content(sender, instance, **kwargs):
+    for model in (Post, ArchivedPost, Comment, ArchivedComment):
+        for queryset in sharded(model.objects.filter(author=instance)):
+            queryset.delete()
+
+
+@receiver(pre_delete, sender=Group)
+def detach_sharded_group_posts(sender, instance, **kwargs):
+    for model in (Post, ArchivedPost):
+        for queryset in sharded(model.objects.filter(group=instance)):
+            queryset.update(group=None)
+
+
+@receiver(pre_delete, sender=Tag)
+def delete_sharded_post_tags(sender, instance, **kwargs):
+    for queryset in sharded(PostTag.objects.filter(tag=instance)):
+        queryset.delete()
+
+
+def _group_keys(group_ids):
+    slugs = (Group.objects.filter(id__in=group_ids)
+             .values_list('slug', flat=True))
+    return [f'group:{slug}' for slug in slugs]
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def purge_post_responses(sender, instance, using, **kwargs):
+    group_ids = {instance.group_id,
+                 getattr(instance, '_previous_group_id', None)} - {None}
+    response_cache.purge(['index', f'post:{instance.pk}',
+                          f'author:{instance.author_id}',
+                          *_group_keys(group_ids)], using)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def purge_comment_responses(sender, instance, using, **kwargs):
+    response_cache.purge([f'post:{instance.post_id}'], using)
+
+
+@receiver(pre_save, sender=Group)
+def remember_previous_slug(sender, instance, **kwargs):
+    instance._previous_slug = (
+        Group.objects.filter(pk=instance.pk)
+        .values_list('slug', flat=True).first()
+        if instance.pk is not None else None)
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def purge_group_responses(sender, instance, using, **kwargs):
+    slugs = {instance.slug, getattr(instance, '_previous_slug', None)}
+    response_cache.purge([f'group:{slug}' for slug in slugs if slug],
+                         using)
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def purge_follow_responses(sender, instance, using, **kwargs):
+    response_cache.purge([f'author:{instance.author_id}',
+                          f'author:{instance.user_id}'], using)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def purge_user_responses(sender, instance, using, update_fields=None,
+                         **kwargs):
+    if update_fields is not None and set(update_fields) == {'last_login'}:
+        return
+    response_cache.purge([f'author:{instance.pk}', f'user:{instance.pk}'],
+                         using)
+
+
+@receiver(post_migrate)
+def reseed_shard_sequences(sender, using, **kwargs):
+    if sender.name == 'posts' and using in shard_aliases():
+        reseed_sequences(using)
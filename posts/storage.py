@@ -0,0 +1,93 @@
+import hashlib
+import os
+import re
+import threading
+from contextlib import contextmanager
+
+from django.apps import apps
+from django.core.files.storage import FileSystemStorage
+from django.db import router, transaction
+from django.db.models import F
+from django.utils.deconstruct import deconstructible
+
+CHUNK_SIZE = 64 * 1024
+_local = threading.local()
+HASHED_NAME_RE = re.compile(r'^[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}(\.\w+)?$')
+
+
+def content_hash(content):
+    digest = hashlib.sha256()
+    for chunk in content.chunks(CHUNK_SIZE):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hashed_name(directory, digest, extension):
+    return os.path.join(directory, digest[:2], digest[2:4],
+                        digest + extension.lower())
+
+
+def is_hashed_name(name, directory):
+    return HASHED_NAME_RE.match(os.path.relpath(name, directory)) is not None
+
+
+def _blobs():
+    return apps.get_model('posts', 'ImageBlob').objects
+
+
+def acquire(name):
+    """Take a reference to an existing blob; False when there is none.
+
+    The UPDATE takes the write lock first, so a concurrent release() has
+    either removed the row and the file already or waits for this one.
+    """
+    return _blobs().filter(name=name).update(refs=F('refs') + 1) > 0
+
+
+def release(name):
+    from sorl.thumbnail import delete
+
+    with transaction.atomic():
+        _blobs().filter(name=name).update(refs=F('refs') - 1)
+        orphaned, _ = _blobs().filter(name=name, refs__lte=0).delete()
+        # Still under the lock: an upload of the same content cannot find
+        # the file and count on it before it is gone.
+        if orphaned:
+            post = apps.get_model('posts', 'Post')(image=name)
+            delete(post.image)
+
+
+@contextmanager
+def references(using):
+    """Give back the references taken by files saved in the block if it
+    fails. A block on the blob database rolls them back by itself; on
+    another one, release() runs after its failed transaction.
+    """
+    outer = getattr(_local, 'taken', None)
+    _local.taken = []
+    try:
+        yield
+    except Exception:
+        if using != router.db_for_write(_blobs().model):
+            for name in _local.taken:
+                release(name)
+        raise
+    finally:
+        _local.taken = outer
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    def _save(self, name, content):
+        directory, filename = os.path.split(name)
+        extension = os.path.splitext(filename)[1]
+        name = hashed_name(directory, content_hash(content), extension)
+        with transaction.atomic():
+            if not acquire(name):
+                if not self.exists(name):
+                    name = super()._save(name, content)
+                _blobs().create(name=name, refs=1)
+        taken = getattr(_local, 'taken', None)
+        if taken is not None:
+            taken.append(name)
+        return name
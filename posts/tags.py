@@ -0,0 +1,62 @@
+import re
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+
+from .models import PostTag, Tag
+
+TAG_RE = re.compile(r'(?<![\w#&])#(\w+)')
+TOP_TAGS_KEY = 'posts:top_tags'
+
+
+def extract_tags(text):
+    max_length = Tag._meta.get_field('name').max_length
+    return {name.lower() for name in TAG_RE.findall(text)
+            if len(name) <= max_length}
+
+
+def _tags_by_name(names):
+    tags = dict(Tag.objects.filter(name__in=names).values_list('name', 'id'))
+    missing = [Tag(name=name) for name in names if name not in tags]
+    if missing:
+        Tag.objects.bulk_create(missing, ignore_conflicts=True)
+        tags = dict(Tag.objects.filter(name__in=names)
+                    .values_list('name', 'id'))
+    return tags
+
+
+def sync_post_tags(post):
+    using = post._state.db
+    names = extract_tags(post.text)
+    current_ids = set(PostTag.objects.using(using).filter(post=post)
+                      .values_list('tag_id', flat=True))
+    current = dict(Tag.objects.filter(id__in=current_ids)
+                   .values_list('name', 'id'))
+    added = names - current.keys()
+    removed = [current[name] for name in current.keys() - names]
+
+    with transaction.atomic(using=using):
+        if removed:
+            (PostTag.objects.using(using)
+             .filter(post=post, tag_id__in=removed).delete())
+            Tag.objects.filter(id__in=removed).update(
+                post_count=F('post_count') - 1)
+        if added:
+            tag_ids = list(_tags_by_name(added).values())
+            PostTag.objects.using(using).bulk_create(
+                PostTag(post=post, tag_id=tag_id, pub_date=post.pub_date)
+                for tag_id in tag_ids)
+            Tag.objects.filter(id__in=tag_ids).update(
+                post_count=F('post_count') + 1)
+
+
+def top_tags():
+    tags = cache.get(TOP_TAGS_KEY)
+    if tags is None:
+        tags = list(Tag.objects.filter(post_count__gt=0)
+                    .order_by('-post_count')
+                    .values_list('name', 'post_count')[:settings.TOP_TAGS])
+        cache.set(TOP_TAGS_KEY, tags, settings.TOP_TAGS_TIMEOUT)
+    return tags
@@ -1,13 +1,52 @@
+import datetime as dt
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import zipfile
+from contextlib import ExitStack
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
+
+from asgiref.sync import async_to_sync
+from asgiref.testing import ApplicationCommunicator
+from django.conf import settings
 from django.core.cache import cache
-from django.test import Client, TestCase
+from django.core.management import call_command
+from django.db import IntegrityError, connection, connections
+from django.test import (Client, SimpleTestCase, TestCase,
+                         TransactionTestCase, override_settings)
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from django.core.files.uploadedfile import SimpleUploadedFile
 
-from posts.models import Comment, Follow, Group, Post, User
+from posts import events
+from posts.events import post_events_app
+from posts.feed import source_querysets
+from posts.management.commands.bench_startup import parse_importtime
+from posts.models import (ArchivedPost, Comment, DailyRollup, Follow, Group,
+                          GroupSubscription, ImageBlob, Post, ProfileRecord,
+                          Tag, User)
+from posts.rebalance import AuthorMove
+from posts.rendering import render_bodies
+from posts.sharding import (ScatterGather, hashed_shard_index,
+                            placement_cache, scatter, shard_aliases,
+                            shard_for, sharded, temporary_databases)
+from posts.warmup import PRELOAD_MODULES, preload, warm
+from users.middleware import bump_user_version, user_cache
+
+
+POSTS_DATABASES = {'default', *settings.POSTS_SHARD_ALIASES}
 
 
 class TestRegistrationProfile(TestCase):
+    databases = POSTS_DATABASES
+
     def setUp(self):
+        cache.clear()
         self.client = Client()
         self.user = User.objects.create_user(username='sarah',
                                              email='flower@gmail.com',
@@ -37,6 +76,8 @@ class TestRegistrationProfile(TestCase):
 
 
 class TestPostCreate(TestCase):
+    databases = POSTS_DATABASES
+
     def setUp(self):
         self.client = Client()
         self.user = User.objects.create_user(username='sarah',
@@ -56,18 +97,20 @@ class TestPostCreate(TestCase):
         self.assertRedirects(response,
                              f'{reverse("login")}?next={reverse("new_post")}',
                              target_status_code=200)
-        self.assertEqual(Post.objects.count(), 0)
+        self.assertEqual(scatter(Post.objects.all()).count(), 0)
 
     def test_registered_user_can_post(self):
         self.client.force_login(self.user, backend=None)
         self.client.post(reverse('new_post'), {'text': 'Nice Try'})
-        self.assertEqual(Post.objects.count(), 1)
-        post = Post.objects.first()
+        self.assertEqual(scatter(Post.objects.all()).count(), 1)
+        post = self.user.posts.first()
         self.assertEqual(post.text, 'Nice Try')
         self.assertEqual(post.author, self.user)
 
 
 class TestNewPostView(TestCase):
+    databases = POSTS_DATABASES
+
     def setUp(self):
         self.client = Client()
         self.text = 'Miracle'
@@ -100,6 +143,8 @@ class TestNewPostView(TestCase):
 
 
 class TestEditPostView(TestCase):
+    databases = POSTS_DATABASES
+
     def setUp(self):
         self.client = Client()
         self.client2 = Client()
@@ -121,7 +166,7 @@ class TestEditPostView(TestCase):
                                  kwargs={'username': self.user.username,
                                          'post_id': self.post.id}),
                          {'text': 'Miracle'})
-        post = Post.objects.get(id=self.post.id)
+        post = self.user.posts.get(id=self.post.id)
         self.assertEqual(post.text, self.text)
 
     def test_no_author_user_cannot_edit_post(self):
@@ -129,7 +174,7 @@ class TestEditPostView(TestCase):
                                   kwargs={'username': self.user.username,
                                           'post_id': self.post.id}),
                          {'text': 'Miracle'})
-        post = Post.objects.get(id=self.post.id)
+        post = self.user.posts.get(id=self.post.id)
         self.assertNotEqual(post.text, self.text)
 
     def test_edit_post_on_post_page(self):
@@ -164,11 +209,13 @@ class TestEditPostView(TestCase):
                                                    self.user.username}))
         self.assertEqual(response.context['post'].text, self.text)
         self.assertEqual(response.status_code, 200)
-        post = Post.objects.get(id=self.post.id)
+        post = self.user.posts.get(id=self.post.id)
         self.assertEqual(post.text, self.text)
 
 
 class Test404IfNoPageFound(TestCase):
+    databases = POSTS_DATABASES
+
     def setUp(self):
         self.client = Client()
 
@@ -178,6 +225,8 @@ class Test404IfNoPageFound(TestCase):
 
 
 class TestImage(TestCase):
+    databases = POSTS_DATABASES
+
     def setUp(self):
         self.client = Client()
         self.user = User.objects.create_user(username='sarah',
@@ -249,6 +298,8 @@ class TestImage(TestCase):
 
 
 class TestComment(TestCase):
+    databases = POSTS_DATABASES
+
     def setUp(self):
         self.client = Client()
         self.user = User.objects.create_user(username='sarah',
@@ -263,7 +314,7 @@ class TestComment(TestCase):
                                  kwargs={'username': self.user.username,
                                          'post_id': self.post.id}),
                          {'text': self.text})
-        comments = Comment.objects.all()
+        comments = self.post.comments.all()
         self.assertEqual(comments.count(), 0)
 
     def test_logged_user_can_comment(self):
@@ -276,7 +327,7 @@ class TestComment(TestCase):
                                            kwargs={'username':
                                                    self.user.username,
                                                    'post_id': self.post.id}))
-        comments = Comment.objects.all()
+        comments = self.post.comments.all()
         self.assertEqual(comments.count(), 1)
         self.assertContains(response, self.text)
         self.assertEqual(response.context['items'][0].text, self.text)
@@ -284,6 +335,8 @@ class TestComment(TestCase):
 
 
 class TestFollow(TestCase):
+    databases = POSTS_DATABASES
+
     def setUp(self):
         self.client = Client()
         self.client2 = Client()
@@ -336,3 +389,870 @@ class TestFollow(TestCase):
         response = self.client2.get(reverse('follow_index'))
         self.assertNotContains(response, self.text)
 
+
+
+class TestGroupSubscription(TestCase):
+    databases = POSTS_DATABASES
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='sarah',
+                                             email='flower@gmail.com',
+                                             password='qazwsx1234')
+        self.author = User.objects.create_user(username='erick',
+                                               email='tots@gmail.com',
+                                               password='qazwsx1234')
+        self.other = User.objects.create_user(username='edwin',
+                                              email='flour@gmail.com',
+                                              password='qazwsx1234')
+        self.group = Group.objects.create(title='Sun', slug='sun')
+        self.client.force_login(self.user, backend=None)
+
+    def test_user_can_subscribe_and_unsubscribe(self):
+        self.client.get(reverse('group_subscribe', args=[self.group.slug]))
+        self.assertTrue(GroupSubscription.objects.filter(
+            user=self.user, group=self.group).exists())
+        self.client.get(reverse('group_unsubscribe', args=[self.group.slug]))
+        self.assertFalse(GroupSubscription.objects.exists())
+
+    def test_feed_merges_authors_and_groups_once(self):
+        Follow.objects.create(user=self.user, author=self.author)
+        GroupSubscription.objects.create(user=self.user, group=self.group)
+        both = Post.objects.create(text='Both', author=self.author,
+                                   group=self.group)
+        in_group = Post.objects.create(text='Group', author=self.other,
+                                       group=self.group)
+        by_author = Post.objects.create(text='Author', author=self.author)
+        Post.objects.create(text='Elsewhere', author=self.other)
+
+        response = self.client.get(reverse('follow_index'))
+        self.assertEqual(response.context['posts'],
+                         [by_author, in_group, both])
+        self.assertIsNone(response.context['next_cursor'])
+
+    def test_feed_pages_by_cursor(self):
+        GroupSubscription.objects.create(user=self.user, group=self.group)
+        posts = [Post.objects.create(text=f'post {number}',
+                                     author=self.other, group=self.group)
+                 for number in range(12)]
+        response = self.client.get(reverse('follow_index'))
+        self.assertEqual(response.context['posts'], posts[:1:-1])
+        response = self.client.get(reverse('follow_index'),
+                                   {'before': response.context['next_cursor']})
+        self.assertEqual(response.context['posts'], posts[1::-1])
+
+    def test_feed_queries_do_not_grow_with_sources(self):
+        groups = [Group.objects.create(title=f'G{number}',
+                                       slug=f'g{number}')
+                  for number in range(3)]
+        querysets = source_querysets([self.author.pk, self.other.pk],
+                                     [group.pk for group in groups])
+        self.assertLessEqual(len(querysets), 2 * len(shard_aliases()))
+
+
+class TestArchive(TestCase):
+    databases = POSTS_DATABASES
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='sarah',
+                                             email='flower@gmail.com',
+                                             password='qazwsx1234')
+        self.old_post = Post.objects.create(text='Old times',
+                                            author=self.user)
+        self.user.posts.filter(id=self.old_post.id).update(
+            pub_date=timezone.now() - dt.timedelta(days=400))
+        Comment.objects.create(post=self.old_post, author=self.user,
+                               text='old comment')
+        self.new_post = Post.objects.create(text='Fresh',
+                                            author=self.user)
+        cache.clear()
+
+    def test_command_moves_old_posts_to_archive(self):
+        call_command('archive_posts', days=365, stdout=StringIO())
+        self.assertEqual(list(self.user.posts.all()), [self.new_post])
+        self.assertEqual(sum(comments.count() for comments
+                             in sharded(Comment.objects.all())), 0)
+        archived = self.user.archived_posts.get(id=self.old_post.id)
+        self.assertEqual(archived.text, 'Old times')
+        self.assertEqual(archived.comments.get().text, 'old comment')
+
+    def test_post_page_falls_back_to_archive(self):
+        call_command('archive_posts', days=365, stdout=StringIO())
+        response = self.client.get(reverse('post_view',
+                                           kwargs={'username':
+                                                   self.user.username,
+                                                   'post_id':
+                                                   self.old_post.id}))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Old times')
+        self.assertContains(response, 'old comment')
+
+    def test_profile_lists_archived_posts_after_hot_ones(self):
+        call_command('archive_posts', days=365, stdout=StringIO())
+        response = self.client.get(reverse('profile',
+                                           kwargs={'username':
+                                                   self.user.username}))
+        self.assertEqual(response.context['paginator'].count, 2)
+        self.assertEqual([post.text for post in response.context['page']],
+                         ['Fresh', 'Old times'])
+
+
+class TestWarmCache(TransactionTestCase):
+    databases = POSTS_DATABASES
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='sarah',
+                                             email='flower@gmail.com',
+                                             password='qazwsx1234')
+        self.group = Group.objects.create(title='Sun', slug='sun')
+        Post.objects.create(text='Warm', author=self.user, group=self.group)
+        cache.clear()
+
+    def test_command_renders_index_groups_and_profiles(self):
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location, ignore_errors=True)
+        out = StringIO()
+        with override_settings(CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.filebased.'
+                           'FileBasedCache',
+                'LOCATION': location}}):
+            call_command('warm_cache', pages=1, workers=2, stdout=out)
+        output = out.getvalue()
+        self.assertIn(reverse('index'), output)
+        self.assertIn(reverse('group_posts', args=[self.group.slug]), output)
+        self.assertIn(reverse('profile', args=[self.user.username]), output)
+        self.assertIn('ошибок: 0', output)
+
+    def test_command_with_local_cache_warms_only_thumbnails(self):
+        out = StringIO()
+        call_command('warm_cache', pages=1, workers=2, stdout=out)
+        output = out.getvalue()
+        self.assertIn('только миниатюры', output)
+        self.assertNotIn(reverse('profile', args=[self.user.username]),
+                         output)
+
+    @override_settings(WARM_CACHE_HOST='localhost')
+    def test_warmed_pages_are_served_to_real_host(self):
+        warm(pages=1, workers=1)
+        response = self.client.get(reverse('index'), HTTP_HOST='localhost')
+        self.assertEqual(response['X-Cache'], 'HIT')
+
+
+class TestStartup(SimpleTestCase):
+    def test_heavy_modules_are_not_imported_by_the_worker(self):
+        script = ('import sys, yatube.wsgi, posts.admin, posts.views; '
+                  f'print([m for m in {PRELOAD_MODULES!r} '
+                  'if m in sys.modules])')
+        result = subprocess.run([sys.executable, '-c', script],
+                                cwd=settings.BASE_DIR, capture_output=True,
+                                text=True, check=True)
+        self.assertEqual(result.stdout.strip(), '[]')
+
+    def test_preload_imports_modules_and_compiles_templates(self):
+        self.assertGreater(preload(), 0)
+        for module in PRELOAD_MODULES:
+            self.assertIn(module, sys.modules)
+
+    def test_parse_importtime(self):
+        output = ('import time: self [us] | cumulative | imported package\n'
+                  'import time:       120 |        120 |   posts.tags\n'
+                  'import time:      1025 |       1145 | posts.forms\n')
+        self.assertEqual(parse_importtime(output),
+                         [('posts.tags', 120, 120),
+                          ('posts.forms', 1025, 1145)])
+
+
+@override_settings(SSE_HEARTBEAT=60)
+class TestPostEvents(TransactionTestCase):
+    databases = POSTS_DATABASES
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='sarah',
+                                             email='flower@gmail.com',
+                                             password='qazwsx1234')
+        self.author = User.objects.create_user(username='erick',
+                                               email='tots@gmail.com',
+                                               password='qazwsx1234')
+        self.stranger = User.objects.create_user(username='edwin',
+                                                 email='flour@gmail.com',
+                                                 password='qazwsx1234')
+        Follow.objects.create(user=self.user, author=self.author)
+        self.client.force_login(self.user, backend=None)
+        self.cookie = (f'{settings.SESSION_COOKIE_NAME}='
+                       f'{self.client.cookies[settings.SESSION_COOKIE_NAME].value}')
+
+    async def _stream(self, cookie, *posts):
+        communicator = ApplicationCommunicator(post_events_app, {
+            'type': 'http', 'method': 'GET', 'path': settings.SSE_PATH,
+            'headers': [(b'cookie', cookie.encode())],
+        })
+        await communicator.send_input({'type': 'http.request'})
+        start = await communicator.receive_output(5)
+        if start['status'] != 200:
+            return start['status'], b''
+        await communicator.receive_output(5)
+        for post in posts:
+            events.publish_post(post)
+        body = (await communicator.receive_output(5))['body']
+        await communicator.send_input({'type': 'http.disconnect'})
+        await communicator.wait(5)
+        return start['status'], body
+
+    def test_followed_author_post_is_pushed(self):
+        ignored = Post.objects.create(text='Not for you', author=self.stranger)
+        post = Post.objects.create(text='Fresh news', author=self.author)
+        with mock.patch.object(events, 'broadcaster', events.Broadcaster()):
+            status, body = async_to_sync(self._stream)(self.cookie,
+                                                       ignored, post)
+        self.assertEqual(status, 200)
+        self.assertIn(b'event: post', body)
+        self.assertIn(b'Fresh news', body)
+        self.assertNotIn(b'Not for you', body)
+
+    def test_anonymous_user_is_rejected(self):
+        with mock.patch.object(events, 'broadcaster', events.Broadcaster()):
+            status, _ = async_to_sync(self._stream)('')
+        self.assertEqual(status, 403)
+
+
+class TestCachedAuthentication(TestCase):
+    databases = POSTS_DATABASES
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='sarah',
+                                             email='flower@gmail.com',
+                                             password='qazwsx1234')
+        user_cache.clear()
+        cache.clear()
+
+    def test_logged_in_page_view_skips_session_and_user_queries(self):
+        self.client.force_login(self.user, backend=None)
+        self.client.get(reverse('follow_index'))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('follow_index'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['user'], self.user)
+        for query in queries:
+            self.assertNotIn('django_session', query['sql'])
+            self.assertNotIn('"auth_user"."password"', query['sql'])
+
+    def test_password_change_logs_out_other_sessions(self):
+        self.client.force_login(self.user, backend=None)
+        self.client.get(reverse('follow_index'))
+        self.user.set_password('new-password-123')
+        self.user.save()
+        response = self.client.get(reverse('follow_index'))
+        self.assertEqual(response.status_code, 302)
+
+    def test_password_change_in_other_process_logs_out_sessions(self):
+        self.client.force_login(self.user, backend=None)
+        self.client.get(reverse('follow_index'))
+        # Another process saves the row: no local signal, only the shared
+        # version changes.
+        self.user.set_password('new-password-123')
+        User.objects.filter(pk=self.user.pk).update(
+            password=self.user.password)
+        bump_user_version(self.user.pk)
+        response = self.client.get(reverse('follow_index'))
+        self.assertEqual(response.status_code, 302)
+
+    def test_anonymous_request_does_not_touch_session(self):
+        response = self.client.get(reverse('index'))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.wsgi_request.session.accessed)
+
+
+class TestContentAddressedImages(TransactionTestCase):
+    databases = POSTS_DATABASES
+
+    image = (b'\x47\x49\x46\x38\x39\x61\x01\x00\x01\x00\x00\x00\x00\x21'
+             b'\xf9\x04\x01\x0a\x00\x01\x00\x2c\x00\x00\x00\x00\x01\x00'
+             b'\x01\x00\x00\x02\x02\x4c\x01\x00\x3b')
+
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=self.media)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.client = Client()
+        self.user = User.objects.create_user(username='sarah',
+                                             email='flower@gmail.com',
+                                             password='qazwsx1234')
+        self.client.force_login(self.user, backend=None)
+
+    def upload(self, name):
+        image = SimpleUploadedFile(name=name, content=self.image,
+                                   content_type='image/gif')
+        self.client.post(reverse('new_post'), {'text': name,
+                                               'image': image})
+        return self.user.posts.get(text=name)
+
+    def test_identical_uploads_are_stored_once(self):
+        first = self.upload('first.gif')
+        second = self.upload('second.gif')
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertEqual(ImageBlob.objects.get().refs, 2)
+        self.assertTrue(first.image.storage.exists(first.image.name))
+
+    def test_file_is_removed_with_last_reference(self):
+        first = self.upload('first.gif')
+        second = self.upload('second.gif')
+        storage = first.image.storage
+        first.delete()
+        self.assertTrue(storage.exists(second.image.name))
+        second.delete()
+        self.assertFalse(storage.exists(second.image.name))
+        self.assertFalse(ImageBlob.objects.exists())
+
+    def test_failed_save_gives_the_reference_back(self):
+        first = self.upload('first.gif')
+        image = SimpleUploadedFile(name='again.gif', content=self.image,
+                                   content_type='image/gif')
+        with self.assertRaises(IntegrityError):
+            Post(text=None, author=self.user, image=image).save()
+        self.assertEqual(ImageBlob.objects.get().refs, 1)
+        self.assertTrue(first.image.storage.exists(first.image.name))
+
+    def test_upload_after_last_release_restores_file(self):
+        first = self.upload('first.gif')
+        storage = first.image.storage
+        first.delete()
+        self.assertFalse(storage.exists(first.image.name))
+        second = self.upload('second.gif')
+        self.assertEqual(ImageBlob.objects.get().refs, 1)
+        self.assertTrue(storage.exists(second.image.name))
+
+    def test_command_deduplicates_existing_files(self):
+        os.makedirs(os.path.join(self.media, 'posts'))
+        for name in ('a.gif', 'b.gif'):
+            with open(os.path.join(self.media, 'posts', name), 'wb') as fh:
+                fh.write(self.image)
+            Post.objects.create(text=name, author=self.user,
+                                image=f'posts/{name}')
+        call_command('dedupe_images', stdout=StringIO())
+        names = set(self.user.posts.values_list('image', flat=True))
+        self.assertEqual(len(names), 1)
+        name = names.pop()
+        self.assertTrue(os.path.exists(os.path.join(self.media, name)))
+        self.assertEqual(ImageBlob.objects.get(name=name).refs, 2)
+        self.assertFalse(os.path.exists(
+            os.path.join(self.media, 'posts', 'a.gif')))
+
+
+class TestAccountExport(TestCase):
+    databases = POSTS_DATABASES
+
+    image = TestContentAddressedImages.image
+
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=self.media)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.client = Client()
+        self.user = User.objects.create_user(username='sarah',
+                                             email='flower@gmail.com',
+                                             password='qazwsx1234')
+        self.author = User.objects.create_user(username='erick',
+                                               email='tots@gmail.com',
+                                               password='qazwsx1234')
+        self.post = Post.objects.create(
+            text='Привет', author=self.user,
+            image=SimpleUploadedFile('small.gif', self.image,
+                                     content_type='image/gif'))
+        self.old_post = Post.objects.create(text='Old', author=self.user)
+        self.user.posts.filter(id=self.old_post.id).update(
+            pub_date=timezone.now() - dt.timedelta(days=400))
+        call_command('archive_posts', days=365, stdout=StringIO())
+        other = Post.objects.create(text='Other', author=self.author)
+        Comment.objects.create(post=other, author=self.user, text='Nice')
+        Follow.objects.create(user=self.user, author=self.author)
+        self.client.force_login(self.user, backend=None)
+
+    def read_archive(self, data):
+        archive = zipfile.ZipFile(BytesIO(data))
+        self.assertIsNone(archive.testzip())
+        return archive
+
+    def test_export_streams_zip_with_rows_and_images(self):
+        response = self.client.get(reverse('account_export'))
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        archive = self.read_archive(b''.join(response.streaming_content))
+
+        posts = [json.loads(line) for line in
+                 archive.read('posts.jsonl').decode().splitlines()]
+        self.assertEqual([(post['text'], post['archived']) for post in posts],
+                         [('Привет', False), ('Old', True)])
+        comments = archive.read('comments.jsonl').decode().splitlines()
+        self.assertEqual(json.loads(comments[0])['text'], 'Nice')
+        self.assertEqual(json.loads(archive.read('subscriptions.jsonl')),
+                         {'author': 'erick'})
+        self.assertEqual(archive.read(f'images/{self.post.image.name}'),
+                         self.image)
+
+    def test_command_writes_archive(self):
+        output = os.path.join(self.media, 'export.zip')
+        call_command('export_account', 'sarah', output=output,
+                     stdout=StringIO())
+        with open(output, 'rb') as fh:
+            archive = self.read_archive(fh.read())
+        self.assertIn('profile.json', archive.namelist())
+
+
+class TestResponseCache(TestCase):
+    databases = POSTS_DATABASES
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(username='sarah',
+                                             email='flower@gmail.com',
+                                             password='qazwsx1234')
+        self.reader = User.objects.create_user(username='edwin',
+                                               email='flour@gmail.com',
+                                               password='qazwsx1234')
+        self.sun = Group.objects.create(title='Sun', slug='sun')
+        self.moon = Group.objects.create(title='Moon', slug='moon')
+        self.post = Post.objects.create(text='Cached', author=self.user,
+                                        group=self.sun)
+
+    def get(self, url):
+        return self.client.get(url).get('X-Cache')
+
+    def test_anonymous_hit_skips_database(self):
+        url = reverse('index')
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response['Cache-Control'],
+                         'public, max-age=0, s-maxage=600')
+        self.assertEqual(response['Surrogate-Key'].split(),
+                         ['group:sun', 'index', f'user:{self.user.pk}'])
+        self.assertEqual(response['Vary'], 'Cookie')
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertContains(response, 'Cached')
+        Post.objects.create(text='Brand new', author=self.user)
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertContains(response, 'Brand new')
+
+    def test_group_and_user_changes_reach_the_index(self):
+        url = reverse('index')
+        self.get(url)
+        self.sun.title = 'Sunrise'
+        self.sun.save()
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertContains(response, 'Sunrise')
+        self.user.username = 'sarah_renamed'
+        self.user.save()
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertContains(response, 'sarah_renamed')
+
+    def test_commenter_rename_purges_post_page(self):
+        Comment.objects.create(post=self.post, author=self.reader,
+                               text='Hello')
+        url = reverse('post_view', args=[self.user.username, self.post.id])
+        self.get(url)
+        self.reader.username = 'edwin_renamed'
+        self.reader.save()
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertContains(response, 'edwin_renamed')
+
+    def test_logged_in_users_are_not_cached(self):
+        self.client.force_login(self.reader, backend=None)
+        self.client.get(reverse('index'))
+        self.assertIsNone(self.get(reverse('index')))
+
+    def test_post_purges_only_its_author_and_groups(self):
+        sun = reverse('group_posts', args=['sun'])
+        moon = reverse('group_posts', args=['moon'])
+        reader = reverse('profile', args=[self.reader.username])
+        for url in (sun, moon, reader):
+            self.get(url)
+        Post.objects.create(text='Moonlight', author=self.user,
+                            group=self.moon)
+        self.assertEqual(self.get(sun), 'HIT')
+        self.assertEqual(self.get(reader), 'HIT')
+        self.assertEqual(self.get(moon), 'MISS')
+
+    def test_comment_and_follow_purge_affected_pages(self):
+        post = reverse('post_view', args=[self.user.username, self.post.id])
+        profile = reverse('profile', args=[self.user.username])
+        self.get(post)
+        self.get(profile)
+        Comment.objects.create(post=self.post, author=self.reader,
+                               text='Fresh comment')
+        self.assertEqual(self.get(profile), 'HIT')
+        response = self.client.get(post)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertContains(response, 'Fresh comment')
+        Follow.objects.create(user=self.reader, author=self.user)
+        self.assertEqual(self.get(profile), 'MISS')
+
+
+class TestRenderedBodies(TestCase):
+    databases = POSTS_DATABASES
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(username='sarah',
+                                             email='flower@gmail.com',
+                                             password='qazwsx1234')
+        User.objects.create_user(username='edwin', email='flour@gmail.com',
+                                 password='qazwsx1234')
+        self.client.force_login(self.user, backend=None)
+
+    def test_render_escapes_and_links(self):
+        with self.assertNumQueries(1):
+            first, second = render_bodies(
+                ['<b>hi</b> @edwin and @nobody\r\nsee https://ya.ru/a?b=1.',
+                 'mail me at sarah@example.com #Sun'])
+        self.assertEqual(
+            first,
+            '&lt;b&gt;hi&lt;/b&gt; <a href="/edwin/">@edwin</a> and '
+            '@nobody<br>see <a href="https://ya.ru/a?b=1" rel="nofollow">'
+            'https://ya.ru/a?b=1</a>.')
+        self.assertEqual(second, 'mail me at sarah@example.com '
+                                 '<a href="/tag/sun/">#Sun</a>')
+
+    @skipUnless(len(settings.POSTS_SHARD_ALIASES) == 1,
+                'с шардами посты не регистрируются в админке')
+    def test_admin_add_sets_author_html_and_tags(self):
+        admin = User.objects.create_superuser('boss', 'boss@example.com',
+                                              'qazwsx1234')
+        self.client.force_login(admin, backend=None)
+        response = self.client.post(reverse('admin:posts_post_add'),
+                                    {'text': 'From admin #Sun',
+                                     'author': self.user.pk})
+        self.assertEqual(response.status_code, 302)
+        post = self.user.posts.get()
+        self.assertEqual(post.author, self.user)
+        self.assertIn('href="/tag/sun/"', post.text_html)
+        self.assertTrue(Tag.objects.filter(name='sun', post_count=1).exists())
+
+    def test_forms_store_rendered_html(self):
+        self.client.post(reverse('new_post'), {'text': 'Hi @edwin'})
+        post = self.user.posts.get()
+        self.assertEqual(post.text_html,
+                         'Hi <a href="/edwin/">@edwin</a>')
+        self.client.post(reverse('add_comment',
+                                 args=[self.user.username, post.id]),
+                         {'text': 'Thanks\n#not_a_link'})
+        self.assertEqual(post.comments.get().text_html,
+                         'Thanks<br>#not_a_link')
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, '<a href="/edwin/">@edwin</a>',
+                            html=True)
+
+    def test_command_backfills_empty_bodies(self):
+        post = Post.objects.create(text='Hello\n@edwin', author=self.user)
+        call_command('render_bodies', batch_size=1, stdout=StringIO())
+        post.refresh_from_db()
+        self.assertEqual(post.text_html,
+                         'Hello<br><a href="/edwin/">@edwin</a>')
+
+
+class TestActivityRollups(TestCase):
+    databases = POSTS_DATABASES
+
+    def setUp(self):
+        self.client = Client()
+        self.staff = User.objects.create_user(username='sarah',
+                                              email='flower@gmail.com',
+                                              password='qazwsx1234',
+                                              is_staff=True)
+        self.author = User.objects.create_user(username='edwin',
+                                               email='flour@gmail.com',
+                                               password='qazwsx1234')
+        self.group = Group.objects.create(title='Sun', slug='sun')
+        for number in range(3):
+            post = Post.objects.create(text=f'post {number}',
+                                       author=self.author,
+                                       group=self.group if number else None)
+        Comment.objects.create(post=post, author=self.staff, text='Hi')
+        Follow.objects.create(user=self.staff, author=self.author)
+
+    def counts(self, metric, dimension):
+        return dict(DailyRollup.objects.filter(metric=metric,
+                                               dimension=dimension)
+                    .values_list('key', 'count'))
+
+    def test_rollup_is_incremental(self):
+        call_command('rollup_activity', stdout=StringIO())
+        self.assertFalse(DailyRollup.objects.exists())
+
+        call_command('rollup_activity', lag=0, stdout=StringIO())
+        self.assertEqual(self.counts('posts', 'site'), {0: 3})
+        self.assertEqual(self.counts('posts', 'group'), {self.group.id: 2})
+        self.assertEqual(self.counts('posts', 'author'), {self.author.id: 3})
+        self.assertEqual(self.counts('comments', 'group'),
+                         {self.group.id: 1})
+        self.assertEqual(self.counts('follows', 'author'),
+                         {self.author.id: 1})
+
+        Post.objects.create(text='one more', author=self.staff)
+        call_command('rollup_activity', lag=0, stdout=StringIO())
+        self.assertEqual(self.counts('posts', 'site'), {0: 4})
+        self.assertEqual(self.counts('posts', 'author'),
+                         {self.author.id: 3, self.staff.id: 1})
+
+    def test_dashboard_reads_only_rollups(self):
+        call_command('rollup_activity', lag=0, stdout=StringIO())
+        self.client.force_login(self.staff, backend=None)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('analytics'),
+                                       {'dimension': 'group'})
+        self.assertContains(response, 'Sun')
+        self.assertFalse(any('posts_post' in query['sql']
+                             for query in queries))
+
+        response = self.client.get(reverse('analytics'),
+                                   {'metric': 'posts', 'format': 'csv'})
+        rows = response.content.decode().splitlines()
+        self.assertEqual(rows[0], 'day,metric,dimension,key,name,count')
+        self.assertTrue(rows[1].endswith(',posts,site,0,Весь сайт,3'))
+
+    def test_dashboard_is_for_staff(self):
+        self.client.force_login(self.author, backend=None)
+        response = self.client.get(reverse('analytics'))
+        self.assertEqual(response.status_code, 302)
+
+
+class TestHashtags(TestCase):
+    databases = POSTS_DATABASES
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='sarah',
+                                             email='flower@gmail.com',
+                                             password='qazwsx1234')
+        self.client.force_login(self.user, backend=None)
+        cache.clear()
+
+    def test_tags_are_extracted_on_create_and_diffed_on_edit(self):
+        self.client.post(reverse('new_post'), {'text': '#Sun and #moon'})
+        post = self.user.posts.get()
+        self.assertEqual(
+            set(Tag.objects.filter(id__in=list(
+                post.post_tags.values_list('tag_id', flat=True)))
+                .values_list('name', flat=True)),
+            {'sun', 'moon'})
+        self.client.post(reverse('post_edit',
+                                 kwargs={'username': self.user.username,
+                                         'post_id': post.id}),
+                         {'text': '#sun under #stars'})
+        self.assertEqual(
+            set(Tag.objects.filter(id__in=list(
+                post.post_tags.values_list('tag_id', flat=True)))
+                .values_list('name', flat=True)),
+            {'sun', 'stars'})
+        self.assertEqual(
+            dict(Tag.objects.values_list('name', 'post_count')),
+            {'sun': 1, 'moon': 0, 'stars': 1})
+
+    def test_tag_feed_pages_by_cursor(self):
+        for number in range(12):
+            self.client.post(reverse('new_post'),
+                             {'text': f'post {number} #sun'})
+        response = self.client.get(reverse('tag_posts', args=['sun']))
+        first_page = [post.text for post in response.context['posts']]
+        self.assertEqual(len(first_page), 10)
+        self.assertEqual(first_page[0], 'post 11 #sun')
+        response = self.client.get(reverse('tag_posts', args=['sun']),
+                                   {'before': response.context['next_cursor']})
+        self.assertEqual([post.text for post in response.context['posts']],
+                         ['post 1 #sun', 'post 0 #sun'])
+        self.assertIsNone(response.context['next_cursor'])
+
+    def test_out_of_range_cursor_shows_first_page(self):
+        self.client.post(reverse('new_post'), {'text': 'post #sun'})
+        for url in (reverse('tag_posts', args=['sun']),
+                    reverse('follow_index')):
+            response = self.client.get(url,
+                                       {'before': '99999999999999999999_1'})
+            self.assertEqual(response.status_code, 200)
+
+    def test_deleted_post_decrements_tag_count(self):
+        self.client.post(reverse('new_post'), {'text': '#sun'})
+        self.user.posts.get().delete()
+        self.assertEqual(Tag.objects.get(name='sun').post_count, 0)
+
+
+class TestRequestProfiler(TestCase):
+    databases = POSTS_DATABASES
+
+    def setUp(self):
+        self.profiles = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.profiles, ignore_errors=True)
+        settings_override = override_settings(PROFILER_ROOT=self.profiles)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.client = Client()
+        self.staff = User.objects.create_user(username='sarah',
+                                              email='flower@gmail.com',
+                                              password='qazwsx1234',
+                                              is_staff=True,
+                                              is_superuser=True)
+        self.user = User.objects.create_user(username='edwin',
+                                             email='flour@gmail.com',
+                                             password='qazwsx1234')
+        Post.objects.create(text='Profiled', author=self.user)
+        cache.clear()
+
+    def test_staff_request_is_profiled(self):
+        self.client.force_login(self.staff, backend=None)
+        response = self.client.get(reverse('index'), {'_profile': 1})
+        self.assertEqual(response.status_code, 200)
+        record = ProfileRecord.objects.get()
+        self.assertEqual(record.path, '/?_profile=1')
+        self.assertGreater(record.query_count, 0)
+        for kind in ('pstats', 'collapsed', 'json'):
+            self.assertTrue(os.path.exists(
+                os.path.join(self.profiles, f'{record.key}.{kind}')))
+        with open(os.path.join(self.profiles, f'{record.key}.json')) as fh:
+            report = json.load(fh)
+        self.assertIn('index.html',
+                      [template['name'] for template in report['templates']])
+        self.assertTrue(any(query['origin'].startswith('posts/')
+                            for query in report['queries']))
+
+        response = self.client.get(reverse(
+            'admin:posts_profilerecord_change', args=[record.pk]))
+        self.assertContains(response, 'index.html')
+        response = self.client.get(reverse('profile_artifact',
+                                           args=[record.key, 'collapsed']))
+        self.assertEqual(response.status_code, 200)
+
+    def test_trigger_is_ignored_for_other_users(self):
+        self.client.force_login(self.user, backend=None)
+        self.client.get(reverse('index'), HTTP_X_PROFILE='1')
+        self.assertFalse(ProfileRecord.objects.exists())
+
+
+class TestSharding(TestCase):
+    databases = POSTS_DATABASES
+
+
+    def setUp(self):
+        self.first = User.objects.create_user(username='sarah',
+                                              email='flower@gmail.com',
+                                              password='qazwsx1234')
+        self.second = User.objects.create_user(username='edwin',
+                                               email='flour@gmail.com',
+                                               password='qazwsx1234')
+
+    def test_hashed_shard_index_is_stable(self):
+        self.assertEqual(hashed_shard_index(42, 4), hashed_shard_index(42, 4))
+        self.assertEqual(hashed_shard_index(42, 1), 0)
+        indexes = {hashed_shard_index(author_id, 4)
+                   for author_id in range(100)}
+        self.assertEqual(indexes, {0, 1, 2, 3})
+
+    def test_scatter_gather_merges_in_feed_order(self):
+        posts = [Post.objects.create(text=f'post {number}', author=author)
+                 for number, author in enumerate([self.first,
+                                                  self.second] * 3)]
+        feed = ScatterGather(
+            sharded(Post.objects.filter(author=self.first))
+            + sharded(Post.objects.filter(author=self.second)))
+        expected = sorted(posts, key=lambda post: (post.pub_date, post.id),
+                          reverse=True)
+        self.assertEqual(feed.count(), 6)
+        self.assertEqual(feed[:6], expected)
+        self.assertEqual(feed[2:4], expected[2:4])
+        self.assertEqual(feed[5], expected[5])
+
+
+SHARDS = (settings.POSTS_SHARD_ALIASES
+          if len(settings.POSTS_SHARD_ALIASES) > 1 else ['shard_0', 'shard_1'])
+
+
+class TestShardedStorage(TestCase):
+    # With POSTS_SHARDS=1 the class runs on two temporary shards, which
+    # '__all__' picks up once setUpClass has added them.
+    databases = '__all__'
+
+    @classmethod
+    def setUpClass(cls):
+        cls.shards = ExitStack()
+        cls.shards.enter_context(
+            override_settings(POSTS_SHARD_ALIASES=SHARDS))
+        cls.shards.enter_context(temporary_databases(
+            [alias for alias in SHARDS
+             if alias not in connections.databases]))
+        try:
+            super().setUpClass()
+        except Exception:
+            cls.shards.close()
+            raise
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.shards.close()
+
+    def setUp(self):
+        self.client = Client()
+        placement_cache.clear()
+        self.user = User.objects.create_user(username='sarah',
+                                             email='flower@gmail.com',
+                                             password='qazwsx1234')
+        self.post = Post.objects.create(text='Sharded', author=self.user)
+        self.comment = Comment.objects.create(post=self.post,
+                                              author=self.user,
+                                              text='here too')
+        cache.clear()
+
+    def test_post_lives_on_authors_shard(self):
+        alias = shard_for(self.user.pk)
+        self.assertEqual(self.post._state.db, alias)
+        self.assertEqual(self.comment._state.db, alias)
+        self.assertTrue(Post.objects.using(alias)
+                        .filter(id=self.post.id).exists())
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, 'Sharded')
+
+    def test_rebalance_moves_author_rows(self):
+        source = shard_for(self.user.pk)
+        target = next(alias for alias in settings.POSTS_SHARD_ALIASES
+                      if alias != source)
+        call_command('rebalance_shards', author=self.user.username,
+                     to=target, wait=0, stdout=StringIO())
+        self.assertEqual(shard_for(self.user.pk), target)
+        self.assertFalse(Post.objects.using(source).exists())
+        moved = Post.objects.using(target).get(id=self.post.id)
+        self.assertEqual(moved.pub_date, self.post.pub_date)
+        self.assertEqual(moved.comments.get().text, 'here too')
+        response = self.client.get(reverse('post_view',
+                                           args=[self.user.username,
+                                                 self.post.id]))
+        self.assertContains(response, 'here too')
+
+    def test_rebalance_keeps_writes_made_during_the_move(self):
+        source = shard_for(self.user.pk)
+        target = next(alias for alias in settings.POSTS_SHARD_ALIASES
+                      if alias != source)
+        move = AuthorMove(self.user.pk, source, target)
+        move.start()
+        # A worker whose cached placement still points at the source.
+        late = Comment.objects.using(source).create(
+            post_id=self.post.id, author=self.user, text='late comment')
+        Post.objects.using(source).filter(id=self.post.id).update(
+            text='Edited late')
+        move.finish()
+        self.assertFalse(Comment.objects.using(source).exists())
+        self.assertEqual(Comment.objects.using(target).get(id=late.id).text,
+                         'late comment')
+        self.assertEqual(Post.objects.using(target).get(id=self.post.id).text,
+                         'Edited late')
@@ -5,8 +5,18 @@ from . import views
 urlpatterns = [
     path('', views.index, name='index'),
     path('group/<slug:slug>/', views.group_posts, name='group_posts'),
+    path('group/<slug:slug>/subscribe/', views.group_subscribe,
+         name='group_subscribe'),
+    path('group/<slug:slug>/unsubscribe/', views.group_unsubscribe,
+         name='group_unsubscribe'),
+    path('tag/<str:name>/', views.tag_posts, name='tag_posts'),
     path('new/', views.new_post, name='new_post'),
     path("follow/", views.follow_index, name="follow_index"),
+    path("follow/events/", views.follow_events, name="follow_events"),
+    path('export/', views.account_export, name='account_export'),
+    path('analytics/', views.analytics, name='analytics'),
+    path('profiling/<slug:key>.<slug:kind>', views.profile_artifact,
+         name='profile_artifact'),
     path('404/', views.page_not_found, name='404'),
     path('500/', views.server_error, name='500'),
     path('<str:username>/', views.profile, name='profile'),
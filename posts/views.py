@@ -1,41 +1,94 @@
+import csv
+import datetime as dt
+
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
 from django.core.paginator import Paginator
+from django.db import transaction
+from django.db.models import Sum, prefetch_related_objects
+from django.http import (FileResponse, Http404, HttpResponse,
+                         StreamingHttpResponse)
 from django.shortcuts import get_object_or_404, redirect, render
+from django.utils import timezone
 from django.views.decorators.http import require_http_methods
 
-from .forms import CommentForm, PostForm
-from .models import Follow, Group, Post, User
+from .archive import ArchiveChain, find_post
+from .events import publish_post
+from .export import export_account
+from .feed import followed_sources, source_querysets
+from .models import (DailyRollup, Follow, Group, GroupSubscription, Post,
+                     PostTag, Tag, User)
+from .pagination import decode_cursor, keyset_page
+from .profiling import ARTIFACTS, profile_storage
+from .response_cache import (add_surrogate_keys, listed_keys, user_keys,
+                             versions_digest)
+from .rollups import key_names
+from .sharding import scatter, sharded
+from .tags import sync_post_tags, top_tags
 
 
 def index(request):
-    post_list = Post.objects.all()
+    add_surrogate_keys(request, 'index')
+    post_list = scatter(Post.objects.prefetch_related('author', 'group'))
 
     paginator = Paginator(post_list, 10)
     page_number = request.GET.get(
         'page')
     page = paginator.get_page(
         page_number)
+    keys = ['index', *listed_keys(page)]
+    add_surrogate_keys(request, *keys)
 
     return render(request, 'index.html',
-                  {'page': page, 'paginator': paginator})
+                  {'page': page, 'paginator': paginator,
+                   'page_version': versions_digest(keys)})
 
 
 def group_posts(request, slug):
+    add_surrogate_keys(request, f'group:{slug}')
     group = get_object_or_404(Group, slug=slug)
-    posts = group.posts.all()
+    posts = scatter(Post.objects.filter(group=group)
+                    .prefetch_related('author', 'group'))
 
     paginator = Paginator(posts, 10)
     page_number = request.GET.get('page')
     page = paginator.get_page(page_number)
+    add_surrogate_keys(request, *listed_keys(page))
+
+    subscribed = False
+    if request.user.is_authenticated:
+        subscribed = GroupSubscription.objects.filter(
+            group=group,
+            user=request.user
+        ).exists()
 
     return render(request, 'posts/group.html',
                   {'group': group,
                    'page': page,
-                   'paginator': paginator})
+                   'paginator': paginator,
+                   'subscribed': subscribed})
+
+
+def tag_posts(request, name):
+    tag = get_object_or_404(Tag, name=name.lower())
+    post_tags = sharded(PostTag.objects.filter(tag=tag)
+                        .select_related('post')
+                        .prefetch_related('post__author', 'post__group'))
+    items, next_cursor = keyset_page(post_tags,
+                                     decode_cursor(request.GET.get('before')),
+                                     id_field='post_id')
+
+    return render(request, 'posts/tag.html',
+                  {'tag': tag,
+                   'posts': [item.post for item in items],
+                   'next_cursor': next_cursor,
+                   'top_tags': top_tags()})
 
 
 @login_required
 def new_post(request):
+    from .forms import PostForm
+
     if request.method == 'POST':
         form = PostForm(request.POST or None,
                         files=request.FILES or None)
@@ -44,6 +97,8 @@ def new_post(request):
             post_new = form.save(commit=False)
             post_new.author = request.user
             post_new.save()
+            sync_post_tags(post_new)
+            transaction.on_commit(lambda: publish_post(post_new))
             return redirect('index')
 
         return render(request, 'posts/new-post.html', {'form': form})
@@ -54,11 +109,13 @@ def new_post(request):
 
 def profile(request, username):
     author = get_object_or_404(User, username=username)
-    posts = author.posts.all()
+    add_surrogate_keys(request, f'author:{author.id}')
+    posts = ArchiveChain(author.posts.all(), author.archived_posts.all())
 
     paginator = Paginator(posts, 10)
     page_number = request.GET.get('page')
     page = paginator.get_page(page_number)
+    add_surrogate_keys(request, *listed_keys(page))
 
     following = False
     if request.user.is_authenticated:
@@ -76,9 +133,19 @@ def profile(request, username):
 
 def post_view(request, username, post_id):
     author = get_object_or_404(User, username=username)
-    post = get_object_or_404(author.posts, id=post_id)
-    comments = post.comments.all()
-    form = CommentForm()
+    add_surrogate_keys(request, f'author:{author.id}', f'post:{post_id}')
+    post = find_post(author, post_id)
+    if post is None:
+        raise Http404
+    add_surrogate_keys(request, *listed_keys([post]))
+    comments = list(post.comments.all())
+    # Before the names are read, like every key.
+    add_surrogate_keys(request, *user_keys(comments))
+    prefetch_related_objects(comments, 'author')
+    form = None
+    if request.user.is_authenticated and not post.archived:
+        from .forms import CommentForm
+        form = CommentForm()
 
     return render(request, 'posts/post.html',
                   {'post': post,
@@ -89,6 +156,8 @@ def post_view(request, username, post_id):
 
 @login_required
 def post_edit(request, username, post_id):
+    from .forms import PostForm
+
     author = get_object_or_404(User, username=username)
     post = get_object_or_404(author.posts, id=post_id)
 
@@ -101,7 +170,7 @@ def post_edit(request, username, post_id):
 
     if request.method == 'POST':
         if form.is_valid():
-            form.save()
+            sync_post_tags(form.save())
             return redirect('post_view', username, post_id)
 
         return render(request, 'posts/new_post.html',
@@ -113,6 +182,8 @@ def post_edit(request, username, post_id):
 
 @login_required
 def add_comment(request, username, post_id):
+    from .forms import CommentForm
+
     author = get_object_or_404(User, username=username)
     post = get_object_or_404(author.posts, id=post_id)
 
@@ -130,15 +201,18 @@ def add_comment(request, username, post_id):
 
 @login_required
 def follow_index(request):
-    posts = Post.objects.filter(author__following__user=request.user)
-
-    paginator = Paginator(posts, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    authors, groups = followed_sources(request.user)
+    posts, next_cursor = keyset_page(source_querysets(authors, groups),
+                                     decode_cursor(request.GET.get('before')))
+    prefetch_related_objects(posts, 'author', 'group')
 
     return render(request, 'posts/follow.html',
-                  {'page': page,
-                   'paginator': paginator})
+                  {'posts': posts,
+                   'next_cursor': next_cursor})
+
+
+def follow_events(request):
+    return HttpResponse(status=204)
 
 
 @require_http_methods(["GET"])
@@ -163,6 +237,96 @@ def profile_unfollow(request, username):
     return redirect('profile', username)
 
 
+@login_required
+def account_export(request):
+    response = StreamingHttpResponse(export_account(request.user),
+                                     content_type='application/zip')
+    response['Content-Disposition'] = (
+        f'attachment; filename="{request.user.username}.zip"')
+    return response
+
+
+@require_http_methods(["GET"])
+@login_required
+def group_subscribe(request, slug):
+    group = get_object_or_404(Group, slug=slug)
+    GroupSubscription.objects.get_or_create(user=request.user, group=group)
+
+    return redirect('group_posts', slug=slug)
+
+
+@require_http_methods(["GET"])
+@login_required
+def group_unsubscribe(request, slug):
+    group = get_object_or_404(Group, slug=slug)
+    GroupSubscription.objects.filter(user=request.user, group=group).delete()
+
+    return redirect('group_posts', slug=slug)
+
+
+@staff_member_required
+def profile_artifact(request, key, kind):
+    if kind not in ARTIFACTS:
+        raise Http404
+    storage = profile_storage()
+    name = f'{key}.{kind}'
+    if not storage.exists(name):
+        raise Http404
+    return FileResponse(storage.open(name), as_attachment=True,
+                        filename=name)
+
+
+@staff_member_required
+def analytics(request):
+    metric = request.GET.get('metric')
+    if metric not in dict(DailyRollup.METRICS):
+        metric = 'posts'
+    dimension = request.GET.get('dimension')
+    if dimension not in dict(DailyRollup.DIMENSIONS):
+        dimension = 'site'
+    try:
+        days = min(max(int(request.GET.get('days', 30)), 1), 366)
+    except ValueError:
+        days = 30
+    since = timezone.now().date() - dt.timedelta(days=days - 1)
+    rollups = DailyRollup.objects.filter(metric=metric, dimension=dimension,
+                                         day__gte=since)
+
+    if request.GET.get('format') == 'csv':
+        rows = list(rollups.order_by('day', 'key')
+                    .values_list('day', 'key', 'count'))
+        names = key_names(dimension, {key for _, key, _ in rows})
+        response = HttpResponse(content_type='text/csv')
+        response['Content-Disposition'] = (
+            f'attachment; filename="{metric}-{dimension}-{days}d.csv"')
+        writer = csv.writer(response)
+        writer.writerow(['day', 'metric', 'dimension', 'key', 'name',
+                         'count'])
+        for day, key, count in rows:
+            writer.writerow([day.isoformat(), metric, dimension, key,
+                             names.get(key, ''), count])
+        return response
+
+    if dimension == 'site':
+        rows = list(rollups.order_by('-day').values_list('day', 'count'))
+    else:
+        totals = list(rollups.values('key').annotate(total=Sum('count'))
+                      .order_by('-total')[:20])
+        names = key_names(dimension, [row['key'] for row in totals])
+        rows = [(names.get(row['key'], row['key']), row['total'])
+                for row in totals]
+    peak = max((count for _, count in rows), default=0) or 1
+
+    return render(request, 'posts/analytics.html',
+                  {'metric': metric,
+                   'dimension': dimension,
+                   'days': days,
+                   'metrics': DailyRollup.METRICS,
+                   'dimensions': DailyRollup.DIMENSIONS,
+                   'rows': [(label, count, count * 100 // peak)
+                            for label, count in rows]})
+
+
 def page_not_found(request, exception):
         return render(request, 'misc/404.html',
                       {"path": request.path},
@@ -0,0 +1,168 @@
+import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait
+from functools import lru_cache
+from importlib import import_module
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import connections
+from django.db.models import Count
+from django.template import engines
+from django.urls import get_resolver, reverse
+
+from .models import Group, Post, User
+from .sharding import scatter, sharded
+
+THUMBNAIL_GEOMETRY = '960x339'
+THUMBNAIL_OPTIONS = {'crop': 'center', 'upscale': True}
+PAGE_SIZE = 10
+# Imported lazily by views and helpers; preload() pays for them up front.
+PRELOAD_MODULES = ('posts.forms', 'numpy', 'PIL.Image',
+                   'sorl.thumbnail.engines.pil_engine')
+
+
+def group_activity():
+    activity = Counter()
+    for queryset in sharded(Post.objects.exclude(group=None)):
+        activity.update(dict(queryset.order_by().values_list('group_id')
+                             .annotate(posts=Count('id'))))
+    return activity
+
+
+def collect_targets(pages, groups, profiles):
+    urls = [reverse('index')]
+    urls += [f"{reverse('index')}?page={number}"
+             for number in range(2, pages + 1)]
+    image_posts = [(Post.objects.all(), pages * PAGE_SIZE)]
+
+    top_groups = Group.objects.in_bulk(
+        [group_id for group_id, _ in group_activity().most_common(groups)])
+    for group in top_groups.values():
+        urls.append(reverse('group_posts', args=[group.slug]))
+        image_posts.append((Post.objects.filter(group=group), PAGE_SIZE))
+
+    top_authors = (User.objects.annotate(followers=Count('following'))
+                   .order_by('-followers')[:profiles])
+    for author in top_authors:
+        urls.append(reverse('profile', args=[author.username]))
+        image_posts.append((author.posts.all(), PAGE_SIZE))
+
+    images = []
+    for queryset, limit in image_posts:
+        for post in scatter(queryset.only('id', 'pub_date', 'image'))[:limit]:
+            if post.image and post.image.name not in images:
+                images.append(post.image.name)
+    return images, urls
+
+
+def warm_thumbnail(name):
+    from sorl.thumbnail import get_thumbnail
+
+    get_thumbnail(Post(image=name).image, THUMBNAIL_GEOMETRY,
+                  **THUMBNAIL_OPTIONS)
+
+
+def shared_cache():
+    """False when every process has its own cache, so pages warmed in one
+    are never seen by the others."""
+    return not isinstance(caches['default'], LocMemCache)
+
+
+@lru_cache(maxsize=None)
+def page_handler():
+    from django.core.handlers.wsgi import WSGIHandler
+
+    return WSGIHandler()
+
+
+def warm_page(url):
+    # The host real traffic arrives with: cached responses are keyed by
+    # the absolute URL.
+    from django.test import RequestFactory
+
+    request = RequestFactory(HTTP_HOST=settings.WARM_CACHE_HOST).get(
+        url, secure=settings.WARM_CACHE_SECURE)
+    response = page_handler().get_response(request)
+    if response.status_code != 200:
+        raise ValueError(f'HTTP {response.status_code}')
+
+
+def _run(task):
+    kind, target = task
+    started = time.monotonic()
+    try:
+        if kind == 'thumbnail':
+            warm_thumbnail(target)
+        else:
+            warm_page(target)
+        error = None
+    except Exception as exc:
+        error = str(exc) or exc.__class__.__name__
+    finally:
+        connections.close_all()
+    return kind, target, time.monotonic() - started, error
+
+
+def warm(pages=None, groups=None, profiles=None, workers=None, budget=None,
+         thumbnails_only=False):
+    pages = settings.WARM_CACHE_PAGES if pages is None else pages
+    groups = settings.WARM_CACHE_GROUPS if groups is None else groups
+    profiles = settings.WARM_CACHE_PROFILES if profiles is None else profiles
+    workers = workers or settings.WARM_CACHE_WORKERS
+    budget = settings.WARM_CACHE_BUDGET if budget is None else budget
+
+    started = time.monotonic()
+    images, urls = collect_targets(pages, groups, profiles)
+    tasks = [('thumbnail', name) for name in images]
+    if not thumbnails_only:
+        tasks += [('page', url) for url in urls]
+
+    pool = ThreadPoolExecutor(max_workers=workers,
+                              thread_name_prefix='warm-cache')
+    futures = [pool.submit(_run, task) for task in tasks]
+    done, pending = wait(futures, timeout=budget)
+    for future in pending:
+        future.cancel()
+    pool.shutdown(wait=False)
+
+    results = [future.result() for future in futures if future in done]
+    skipped = [task for task, future in zip(tasks, futures)
+               if future not in done]
+    return results, skipped, time.monotonic() - started
+
+
+def warm_in_background():
+    thread = threading.Thread(target=warm, name='warm-cache', daemon=True)
+    thread.start()
+    return thread
+
+
+def project_templates(engine):
+    for template_dir in map(str, engine.template_dirs):
+        if not template_dir.startswith(settings.BASE_DIR):
+            continue
+        for root, _, files in os.walk(template_dir):
+            for name in files:
+                if name.endswith('.html'):
+                    path = os.path.relpath(os.path.join(root, name),
+                                           template_dir)
+                    yield path.replace(os.sep, '/')
+
+
+def preload():
+    """Do the one-off work of a worker's first requests before it accepts
+    traffic: import lazy modules, build the URL resolver and compile the
+    project's templates (kept by the cached loader when DEBUG is off)."""
+    for module in PRELOAD_MODULES:
+        import_module(module)
+    get_resolver().reverse_dict
+    templates = 0
+    for engine in engines.all():
+        for name in project_templates(engine):
+            engine.get_template(name)
+            templates += 1
+    return templates
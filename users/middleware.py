@@ -0,0 +1,123 @@
+import copy
+import threading
+import time
+
+from django.conf import settings
+from django.contrib import auth
+from django.contrib.auth import get_user_model
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.auth.signals import user_logged_out
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.crypto import constant_time_compare
+from django.utils.functional import SimpleLazyObject
+
+User = get_user_model()
+
+VERSION_PREFIX = 'auth-user:'
+
+
+def user_version(user_id):
+    """Version of the user's row, shared by processes through the cache."""
+    key = f'{VERSION_PREFIX}{user_id}'
+    version = cache.get(key)
+    if version is None:
+        # A fresh value rather than 0, so a counter that was evicted never
+        # matches an entry cached before the eviction.
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def bump_user_version(user_id):
+    key = f'{VERSION_PREFIX}{user_id}'
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), None)
+
+
+class UserCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._users = {}
+
+    def get(self, user_id, version):
+        entry = self._users.get(user_id)
+        if entry is None:
+            return None
+        expires, cached_version, user = entry
+        if expires < time.monotonic() or cached_version != version:
+            self.evict(user_id)
+            return None
+        return copy.copy(user)
+
+    def set(self, user, version):
+        expires = time.monotonic() + settings.AUTH_USER_CACHE_TTL
+        with self._lock:
+            self._users[user.pk] = (expires, version, copy.copy(user))
+
+    def evict(self, user_id):
+        with self._lock:
+            self._users.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+
+
+user_cache = UserCache()
+
+
+def get_user(request):
+    session = request.session
+    try:
+        user_id = User._meta.pk.to_python(session[auth.SESSION_KEY])
+        backend_path = session[auth.BACKEND_SESSION_KEY]
+    except KeyError:
+        return AnonymousUser()
+
+    # Read before the row, so a change committed in between leaves the row
+    # cached under an outdated version.
+    version = user_version(user_id)
+    user = user_cache.get(user_id, version)
+    if (user is not None
+            and backend_path in settings.AUTHENTICATION_BACKENDS
+            and constant_time_compare(session.get(auth.HASH_SESSION_KEY, ''),
+                                      user.get_session_auth_hash())):
+        return user
+
+    user = auth.get_user(request)
+    if user.is_authenticated:
+        user_cache.set(user, version)
+    return user
+
+
+class CachedAuthenticationMiddleware(AuthenticationMiddleware):
+    def process_request(self, request):
+        if settings.SESSION_COOKIE_NAME not in request.COOKIES:
+            request.user = AnonymousUser()
+            return
+        request.user = SimpleLazyObject(lambda: get_user(request))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def evict_saved_user(sender, instance, **kwargs):
+    """Evict the row here and, through the version, in other processes.
+
+    Bumped again after commit: another process may cache the old row
+    until then.
+    """
+    user_cache.evict(instance.pk)
+    bump_user_version(instance.pk)
+    transaction.on_commit(lambda: bump_user_version(instance.pk))
+
+
+@receiver(user_logged_out)
+def evict_logged_out_user(sender, request, user, **kwargs):
+    if user is not None:
+        user_cache.evict(user.pk)
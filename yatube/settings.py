@@ -12,9 +12,10 @@ https://docs.djangoproject.com/en/2.2/ref/settings/
 
 import os
 from dotenv import load_dotenv
-load_dotenv()
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# An explicit path spares the search up the call stack and directories.
+load_dotenv(os.path.join(BASE_DIR, '.env'))
 
 
 # Quick-start development settings - unsuitable for production
@@ -52,11 +53,13 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'posts.response_cache.ResponseCacheMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'users.middleware.CachedAuthenticationMiddleware',
+    'posts.profiling.ProfilerMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -83,6 +86,7 @@ TEMPLATE_LOADERS = (
     'django.template.loaders.app_directories.Loader',
 )
 WSGI_APPLICATION = 'yatube.wsgi.application'
+ASGI_APPLICATION = 'yatube.asgi.application'
 CACHES = {
         'default': {
                 'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
@@ -99,6 +103,20 @@ DATABASES = {
     }
 }
 
+# Posts and comments live on POSTS_SHARDS databases chosen by author,
+# everything else stays on 'default'. One shard means 'default' only.
+POSTS_SHARDS = int(os.getenv('POSTS_SHARDS', 1))
+POSTS_SHARD_ALIASES = ['default']
+if POSTS_SHARDS > 1:
+    POSTS_SHARD_ALIASES = [f'shard_{index}' for index in range(POSTS_SHARDS)]
+    for alias in POSTS_SHARD_ALIASES:
+        DATABASES[alias] = {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(BASE_DIR, f'db_{alias}.sqlite3'),
+        }
+DATABASE_ROUTERS = ['posts.sharding.ShardRouter']
+SHARD_PLACEMENT_TTL = int(os.getenv('SHARD_PLACEMENT_TTL', 60))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -146,3 +164,47 @@ LOGIN_URL = '/auth/login/'
 LOGIN_REDIRECT_URL = 'index'
 
 SITE_ID = 2
+
+POSTS_ARCHIVE_AFTER_DAYS = int(os.getenv('POSTS_ARCHIVE_AFTER_DAYS', 365))
+POSTS_ARCHIVE_BATCH_SIZE = int(os.getenv('POSTS_ARCHIVE_BATCH_SIZE', 500))
+
+WARM_CACHE_ON_STARTUP = os.getenv('WARM_CACHE_ON_STARTUP') == '1'
+WARM_CACHE_PAGES = int(os.getenv('WARM_CACHE_PAGES', 3))
+WARM_CACHE_GROUPS = int(os.getenv('WARM_CACHE_GROUPS', 5))
+WARM_CACHE_PROFILES = int(os.getenv('WARM_CACHE_PROFILES', 5))
+WARM_CACHE_WORKERS = int(os.getenv('WARM_CACHE_WORKERS', 4))
+WARM_CACHE_BUDGET = float(os.getenv('WARM_CACHE_BUDGET', 30))
+# Host and scheme of the warmed pages; must be the ones clients use and be
+# listed in ALLOWED_HOSTS.
+WARM_CACHE_HOST = os.getenv('WARM_CACHE_HOST', 'localhost')
+WARM_CACHE_SECURE = os.getenv('WARM_CACHE_SECURE') == '1'
+
+WSGI_PRELOAD = os.getenv('WSGI_PRELOAD') == '1'
+
+SSE_PATH = '/follow/events/'
+SSE_HEARTBEAT = float(os.getenv('SSE_HEARTBEAT', 15))
+SSE_POLL_INTERVAL = float(os.getenv('SSE_POLL_INTERVAL', 2))
+SSE_QUEUE_SIZE = int(os.getenv('SSE_QUEUE_SIZE', 32))
+SSE_MAX_CONNECTIONS = int(os.getenv('SSE_MAX_CONNECTIONS', 10000))
+
+SESSION_ENGINE = os.getenv('SESSION_ENGINE',
+                           'django.contrib.sessions.backends.signed_cookies')
+# Cached User rows are invalidated in other processes through a version
+# key in the default cache. With a per-process cache (LocMemCache) other
+# workers only notice a password change or deactivation when their entry
+# expires, up to AUTH_USER_CACHE_TTL seconds later.
+AUTH_USER_CACHE_TTL = int(os.getenv('AUTH_USER_CACHE_TTL', 30))
+
+TOP_TAGS = int(os.getenv('TOP_TAGS', 20))
+TOP_TAGS_TIMEOUT = int(os.getenv('TOP_TAGS_TIMEOUT', 60))
+
+PROFILER_TRIGGER_PARAM = '_profile'
+PROFILER_HEADER = 'HTTP_X_PROFILE'
+PROFILER_ROOT = os.path.join(BASE_DIR, 'profiles')
+PROFILER_SAMPLE_INTERVAL = float(os.getenv('PROFILER_SAMPLE_INTERVAL', 0.001))
+
+RESPONSE_CACHE_TIMEOUT = int(os.getenv('RESPONSE_CACHE_TIMEOUT', 600))
+RESPONSE_CACHE_PURGE_URL = os.getenv('RESPONSE_CACHE_PURGE_URL')
+
+ROLLUP_BATCH_SIZE = int(os.getenv('ROLLUP_BATCH_SIZE', 5000))
+ROLLUP_LAG = int(os.getenv('ROLLUP_LAG', 300))